@@ -0,0 +1,12 @@
+# app/__main__.py
+# Permite executar o modo sem interface com: python -m app <entradas> [--saida PASTA]
+
+import multiprocessing
+import sys
+
+from .cli import main
+
+if __name__ == "__main__":
+    # Necessário para o pool de processos de OCR no executável do PyInstaller (Windows)
+    multiprocessing.freeze_support()
+    sys.exit(main())
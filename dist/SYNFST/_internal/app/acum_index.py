@@ -0,0 +1,146 @@
+# app/acum_index.py
+
+import json
+import os
+import re
+import threading
+from typing import Optional
+
+from .cache import hash_arquivo
+
+# ==============================================================================
+# ÍNDICE COMPILADO DA PLANILHA DE MAPEAMENTO 'ACUM'
+# ==============================================================================
+# A planilha (ex: CODIGOS_DA_REINF_-_PADRAO.xlsx) é lida uma única vez e vira
+# dois dicionários: código exato -> acumulador e código só com dígitos ->
+# acumulador. O índice fica em memória e também em um arquivo ao lado da
+# planilha ('<planilha>.indice.json'), para que reinícios não precisem abrir o
+# Excel de novo. Ele é invalidado quando o tamanho/mtime e o hash do arquivo mudam.
+# ==============================================================================
+
+VERSAO_INDICE = 1
+COLUNA_REFERENCIA = 'Referência'
+COLUNA_ACUM = 'ACUMULADOR TOMADOS'
+
+
+class IndiceAcum:
+    """Busca O(1) do acumulador pelo código de serviço."""
+
+    def __init__(self, exato: dict, normalizado: dict):
+        self.exato = exato
+        self.normalizado = normalizado
+
+    def buscar(self, codigo_servico) -> Optional[str]:
+        """
+        Retorna o acumulador do código (exato primeiro, depois apenas dígitos).
+        None indica que o código não está na planilha; "" que está, mas sem ACUM.
+        """
+        codigo_str = str(codigo_servico or "").strip()
+        if not codigo_str:
+            return None
+        if codigo_str in self.exato:
+            return self.exato[codigo_str]
+        codigo_normalizado = re.sub(r'\D', '', codigo_str)
+        if codigo_normalizado:
+            return self.normalizado.get(codigo_normalizado)
+        return None
+
+
+_indices = {}
+_indices_lock = threading.Lock()
+
+def _caminho_sidecar(caminho_planilha: str) -> str:
+    return f"{caminho_planilha}.indice.json"
+
+def _formatar_acum(valor) -> str:
+    valor_str = str(valor).strip() if valor is not None else ""
+    if not valor_str or valor_str.lower() == "nan":
+        return ""
+    try:
+        return str(int(float(valor_str)))
+    except ValueError:
+        return valor_str
+
+def _compilar_planilha(caminho_planilha: str) -> IndiceAcum:
+    import pandas as pd
+
+    print(f"Compilando índice da planilha de mapeamento: {caminho_planilha}")
+    df_map = pd.read_excel(caminho_planilha, dtype=str)
+    df_map.columns = [str(c).strip() for c in df_map.columns]
+    exato, normalizado = {}, {}
+    if COLUNA_REFERENCIA not in df_map.columns or COLUNA_ACUM not in df_map.columns:
+        print(f"AVISO: A planilha de mapeamento não contém as colunas '{COLUNA_REFERENCIA}' e '{COLUNA_ACUM}'.")
+        return IndiceAcum(exato, normalizado)
+
+    for referencia, valor_acum in zip(df_map[COLUNA_REFERENCIA], df_map[COLUNA_ACUM]):
+        if pd.isna(referencia):
+            continue
+        referencia = str(referencia).strip()
+        acum = "" if pd.isna(valor_acum) else _formatar_acum(valor_acum)
+        # Como no filtro original, vale a primeira linha que casar com o código
+        exato.setdefault(referencia, acum)
+        referencia_normalizada = re.sub(r'\D', '', referencia)
+        if referencia_normalizada:
+            normalizado.setdefault(referencia_normalizada, acum)
+    return IndiceAcum(exato, normalizado)
+
+def _ler_sidecar(caminho_planilha: str) -> Optional[dict]:
+    try:
+        with open(_caminho_sidecar(caminho_planilha), 'r', encoding='utf-8') as f:
+            dados = json.load(f)
+        return dados if dados.get("versao") == VERSAO_INDICE else None
+    except (OSError, ValueError):
+        return None
+
+def _gravar_sidecar(caminho_planilha: str, assinatura: tuple, sha256: str, indice: IndiceAcum):
+    try:
+        with open(_caminho_sidecar(caminho_planilha), 'w', encoding='utf-8') as f:
+            json.dump({
+                "versao": VERSAO_INDICE, "tamanho": assinatura[0], "mtime_ns": assinatura[1], "sha256": sha256,
+                "exato": indice.exato, "normalizado": indice.normalizado
+            }, f, ensure_ascii=False)
+    except OSError as e:
+        print(f"AVISO: Não foi possível salvar o índice da planilha 'Acum' em disco: {e}")
+
+def carregar_indice_acum(caminho_planilha: str) -> Optional[IndiceAcum]:
+    """
+    Retorna o índice da planilha, usando (nesta ordem) a memória, o arquivo de
+    índice em disco ou uma nova compilação da planilha.
+    """
+    if not caminho_planilha or not os.path.exists(caminho_planilha):
+        return None
+    info = os.stat(caminho_planilha)
+    assinatura = (info.st_size, info.st_mtime_ns)
+
+    with _indices_lock:
+        em_memoria = _indices.get(caminho_planilha)
+        if em_memoria and em_memoria[0] == assinatura:
+            return em_memoria[1]
+
+        sidecar = _ler_sidecar(caminho_planilha)
+        indice = None
+        sha256 = None
+        if sidecar and (sidecar.get("tamanho"), sidecar.get("mtime_ns")) == assinatura:
+            indice = IndiceAcum(sidecar["exato"], sidecar["normalizado"])
+        else:
+            # O mtime mudou (ex: arquivo copiado de novo); o conteúdo pode ser o mesmo
+            sha256 = hash_arquivo(caminho_planilha)
+            if sidecar and sidecar.get("sha256") == sha256:
+                indice = IndiceAcum(sidecar["exato"], sidecar["normalizado"])
+            else:
+                indice = _compilar_planilha(caminho_planilha)
+            _gravar_sidecar(caminho_planilha, assinatura, sha256, indice)
+
+        _indices[caminho_planilha] = (assinatura, indice)
+        return indice
+
+def remover_indice_acum(caminho_planilha: str):
+    """Descarta o índice em memória e em disco (usado ao excluir a planilha)."""
+    with _indices_lock:
+        _indices.pop(caminho_planilha, None)
+    caminho_sidecar = _caminho_sidecar(caminho_planilha) if caminho_planilha else None
+    if caminho_sidecar and os.path.exists(caminho_sidecar):
+        try:
+            os.remove(caminho_sidecar)
+        except OSError as e:
+            print(f"Erro ao excluir o índice da planilha: {e}")
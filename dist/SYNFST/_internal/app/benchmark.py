@@ -0,0 +1,240 @@
+# app/benchmark.py
+
+import argparse
+import json
+import multiprocessing
+import os
+import re
+import tempfile
+import time
+import zipfile
+
+import fitz
+
+# ==============================================================================
+# BENCHMARK DO LOTE (OFFLINE)
+# ==============================================================================
+# Gera NFS-e sintéticas com o fitz e roda o lote completo (guardião ->
+# segmentador -> extrator -> enriquecimento -> entrega) contra um LLM simulado
+# local, sem rede e sem chaves de API. Serve para comparar o throughput entre
+# versões: o resultado (notas/s + métricas do lote) fica em 'benchmark.json'.
+#
+# Variantes geradas:
+#   - texto:        PDF de uma página com camada de texto;
+#   - digitalizada: a mesma nota rasterizada dentro do PDF (força o OCR);
+#   - imagem:       a nota como .png;
+#   - multinota:    um PDF com várias notas, uma por página (testa a segmentação);
+#   - compactada:   um .zip com PDFs de texto (testa o guardião).
+#
+# Uso: python -m app.benchmark [--notas 20] [--latencia 0.05] [--sem-ocr] [--pasta DIR]
+# ==============================================================================
+
+PROVEDOR_SIMULADO = "simulado"
+
+# Rótulo impresso na nota sintética -> campo do schema. O LLM simulado lê os mesmos rótulos.
+ROTULOS_CAMPOS = {
+    "Número da Nota": "numero_nf",
+    "Data de Emissão": "data_emissao",
+    "CNPJ do Prestador": "prestador_cnpj",
+    "Razão Social do Prestador": "prestador_razao_social",
+    "Município do Prestador": "prestador_municipio",
+    "UF do Prestador": "prestador_uf",
+    "CNPJ do Tomador": "tomador_cnpj",
+    "Razão Social do Tomador": "tomador_razao_social",
+    "Código do Serviço": "codigo_servico",
+    "Valor Total": "valor_total",
+    "Base de Cálculo": "base_calculo_iss",
+    "Alíquota ISS": "aliquota_iss",
+    "Valor ISS": "valor_iss",
+    "Discriminação": "discriminacao_servicos",
+}
+
+# --- Notas sintéticas ---
+
+def _cnpj_com_digitos(base: str) -> str:
+    """Completa uma base de 12 dígitos com os dígitos verificadores e formata o CNPJ."""
+    def _digito(numeros, pesos):
+        resto = sum(n * p for n, p in zip(numeros, pesos)) % 11
+        return 0 if resto < 2 else 11 - resto
+    numeros = [int(c) for c in base]
+    numeros.append(_digito(numeros, [5, 4, 3, 2, 9, 8, 7, 6, 5, 4, 3, 2]))
+    numeros.append(_digito(numeros, [6, 5, 4, 3, 2, 9, 8, 7, 6, 5, 4, 3, 2]))
+    d = "".join(map(str, numeros))
+    return f"{d[:2]}.{d[2:5]}.{d[5:8]}/{d[8:12]}-{d[12:]}"
+
+def dados_nota_sintetica(numero: int) -> dict:
+    valor = 1000 + numero * 37.5
+    iss = valor * 0.05
+    return {
+        "numero_nf": str(1000 + numero),
+        "data_emissao": f"{1 + numero % 28:02d}/03/2025",
+        "prestador_cnpj": _cnpj_com_digitos(f"{10000000 + numero:08d}0001"),
+        "prestador_razao_social": f"PRESTADORA DE SERVICOS {numero:04d} LTDA",
+        "prestador_municipio": "Exemplópolis",
+        "prestador_uf": "SP",
+        "tomador_cnpj": _cnpj_com_digitos("123456780001"),
+        "tomador_razao_social": "TOMADORA EXEMPLO S.A.",
+        "codigo_servico": "17.01",
+        "valor_total": f"{valor:_.2f}".replace(".", ",").replace("_", "."),
+        "base_calculo_iss": f"{valor:_.2f}".replace(".", ",").replace("_", "."),
+        "aliquota_iss": "5,00%",
+        "valor_iss": f"{iss:_.2f}".replace(".", ",").replace("_", "."),
+        "discriminacao_servicos": f"Assessoria e consultoria contábil referente à competência {numero % 12 + 1:02d}/2025.",
+    }
+
+def _desenhar_nota(pagina: fitz.Page, dados: dict):
+    linhas = [
+        "PREFEITURA MUNICIPAL DE EXEMPLÓPOLIS",
+        "SECRETARIA MUNICIPAL DA FAZENDA",
+        "NOTA FISCAL DE SERVIÇOS ELETRÔNICA - NFS-e",
+        "",
+    ] + [f"{rotulo}: {dados[campo]}" for rotulo, campo in ROTULOS_CAMPOS.items()] + [
+        "",
+        "Documento emitido por ME ou EPP optante pelo Simples Nacional.",
+        "Não gera direito a crédito fiscal de IPI.",
+    ]
+    y = 60
+    for linha in linhas:
+        pagina.insert_text((50, y), linha, fontsize=11)
+        y += 20
+
+def _pdf_de_texto(notas: list) -> fitz.Document:
+    doc = fitz.open()
+    for dados in notas:
+        _desenhar_nota(doc.new_page(), dados)
+    return doc
+
+def _pixmap_da_nota(dados: dict, dpi: int = 150) -> fitz.Pixmap:
+    with _pdf_de_texto([dados]) as doc:
+        return doc[0].get_pixmap(dpi=dpi, colorspace=fitz.csGRAY)
+
+def gerar_amostras(pasta: str, num_notas: int, incluir_ocr: bool = True) -> dict:
+    """Gera as variantes em rodízio até somar 'num_notas' notas. Retorna a contagem por variante."""
+    os.makedirs(pasta, exist_ok=True)
+    variantes = ["texto", "digitalizada", "imagem", "multinota", "compactada"] if incluir_ocr else ["texto", "multinota", "compactada"]
+    contagem = {v: 0 for v in variantes}
+    numero, indice = 0, 0
+    while numero < num_notas:
+        variante = variantes[indice % len(variantes)]
+        nome_base = os.path.join(pasta, f"{indice:04d}_{variante}")
+        if variante == "texto":
+            notas = [dados_nota_sintetica(numero)]
+            with _pdf_de_texto(notas) as doc:
+                doc.save(f"{nome_base}.pdf")
+        elif variante == "digitalizada":
+            notas = [dados_nota_sintetica(numero)]
+            pix = _pixmap_da_nota(notas[0])
+            with fitz.open() as doc:
+                pagina = doc.new_page()
+                pagina.insert_image(pagina.rect, pixmap=pix)
+                doc.save(f"{nome_base}.pdf")
+        elif variante == "imagem":
+            notas = [dados_nota_sintetica(numero)]
+            _pixmap_da_nota(notas[0]).save(f"{nome_base}.png")
+        elif variante == "multinota":
+            notas = [dados_nota_sintetica(numero + i) for i in range(min(3, num_notas - numero))]
+            with _pdf_de_texto(notas) as doc:
+                doc.save(f"{nome_base}.pdf")
+        else:
+            notas = [dados_nota_sintetica(numero + i) for i in range(min(2, num_notas - numero))]
+            with zipfile.ZipFile(f"{nome_base}.zip", 'w', zipfile.ZIP_DEFLATED) as zipf:
+                for i, dados in enumerate(notas):
+                    with _pdf_de_texto([dados]) as doc:
+                        zipf.writestr(f"nota_{i + 1}.pdf", doc.tobytes())
+        contagem[variante] += len(notas)
+        numero += len(notas)
+        indice += 1
+    return contagem
+
+# --- LLM simulado ---
+
+def criar_llm_simulado(latencia: float = 0.05):
+    """
+    Modelo de chat local: espera 'latencia' segundos (simulando a rede) e responde
+    em JSON com os campos lidos pelos rótulos da nota sintética, com 'usage_metadata'.
+    """
+    from langchain_core.messages import AIMessage
+    from langchain_core.runnables import RunnableLambda
+
+    def _responder(entrada):
+        mensagens = entrada.to_messages()
+        texto = mensagens[-1].content
+        time.sleep(latencia)
+        dados = {}
+        for rotulo, campo in ROTULOS_CAMPOS.items():
+            encontrado = re.search(rf"{re.escape(rotulo)}\s*:\s*(.+)", texto)
+            if encontrado:
+                dados[campo] = encontrado.group(1).strip()
+        conteudo = json.dumps(dados, ensure_ascii=False)
+        tokens_entrada = sum(len(str(m.content)) for m in mensagens) // 4
+        tokens_saida = len(conteudo) // 4
+        return AIMessage(content=conteudo, usage_metadata={
+            "input_tokens": tokens_entrada, "output_tokens": tokens_saida, "total_tokens": tokens_entrada + tokens_saida,
+        })
+
+    return RunnableLambda(_responder)
+
+# --- Execução ---
+
+def executar_benchmark(num_notas: int = 20, latencia: float = 0.05, incluir_ocr: bool = True, pasta: str = None, usar_cache: bool = False) -> dict:
+    """
+    Roda o lote completo em uma pasta de trabalho isolada (config.json, cache e
+    saídas próprios) e devolve o resultado do benchmark.
+    """
+    from .config_manager import CONFIG_FILE
+    from .providers import registrar_provedor
+    from .cli import processar_em_lote
+
+    pasta = os.path.abspath(pasta or tempfile.mkdtemp(prefix="synfst_benchmark_"))
+    os.makedirs(pasta, exist_ok=True)
+    diretorio_original = os.getcwd()
+    os.chdir(pasta)
+    try:
+        with open(CONFIG_FILE, 'w', encoding='utf-8') as f:
+            json.dump({
+                "provider": PROVEDOR_SIMULADO, "model": "simulado", "custom_model": "", "acum_mapping_file": None,
+                "cache_habilitado": usar_cache,
+                "limites_provedores": {PROVEDOR_SIMULADO: {"concorrencia": 8, "rpm": 0}},
+            }, f, indent=2)
+        registrar_provedor(PROVEDOR_SIMULADO, lambda nome_modelo: criar_llm_simulado(latencia))
+
+        contagem = gerar_amostras(os.path.join(pasta, "amostras"), num_notas, incluir_ocr)
+        inicio = time.perf_counter()
+        relatorio = processar_em_lote([os.path.join(pasta, "amostras")], os.path.join(pasta, "saida"))
+        duracao = time.perf_counter() - inicio
+    finally:
+        os.chdir(diretorio_original)
+
+    resultado = {
+        "notas_geradas": num_notas,
+        "variantes": contagem,
+        "notas_processadas": relatorio["total_notas"],
+        "notas_aprovadas": relatorio["aprovadas"],
+        "duracao_s": round(duracao, 3),
+        "notas_por_segundo": round(relatorio["total_notas"] / duracao, 3) if duracao else None,
+        "latencia_llm_s": latencia,
+        "cache_habilitado": usar_cache,
+        "metricas": relatorio.get("metricas"),
+        "pasta": pasta,
+    }
+    with open(os.path.join(pasta, "benchmark.json"), 'w', encoding='utf-8') as f:
+        json.dump(resultado, f, indent=2, ensure_ascii=False)
+    return resultado
+
+def main(argv: list = None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m app.benchmark", description="SYNFST - benchmark offline do lote com NFS-e sintéticas e LLM simulado.")
+    parser.add_argument("--notas", type=int, default=20, help="Quantidade de notas sintéticas (padrão: 20).")
+    parser.add_argument("--latencia", type=float, default=0.05, help="Latência simulada de cada chamada ao LLM, em segundos (padrão: 0.05).")
+    parser.add_argument("--sem-ocr", action="store_true", help="Gera apenas variantes com camada de texto (sem Tesseract).")
+    parser.add_argument("--com-cache", action="store_true", help="Mantém o cache de extração habilitado.")
+    parser.add_argument("--pasta", help="Pasta de trabalho (padrão: uma pasta temporária nova).")
+    args = parser.parse_args(argv)
+
+    resultado = executar_benchmark(args.notas, args.latencia, not args.sem_ocr, args.pasta, args.com_cache)
+    print(f"\n📊 BENCHMARK: {resultado['notas_processadas']} notas em {resultado['duracao_s']}s ({resultado['notas_por_segundo']} notas/s), {resultado['notas_aprovadas']} aprovadas.")
+    print(f"Resultado completo em: {os.path.join(resultado['pasta'], 'benchmark.json')}")
+    return 0 if resultado["notas_processadas"] == args.notas else 1
+
+if __name__ == "__main__":
+    multiprocessing.freeze_support()
+    raise SystemExit(main())
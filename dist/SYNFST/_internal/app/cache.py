@@ -0,0 +1,213 @@
+# app/cache.py
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Optional
+
+from .path_utils import data_path
+
+# ==============================================================================
+# CACHE PERSISTENTE DE EXTRAÇÃO (ENDEREÇADO POR CONTEÚDO)
+# ==============================================================================
+# Duas camadas em um único arquivo SQLite:
+#   - 'texto':     texto bruto (direto ou OCR), chaveado pelo hash do arquivo,
+#                  intervalo de páginas e configuração do OCR.
+#   - 'resultado': JSON estruturado pelo LLM, chaveado pelo hash do texto,
+#                  provedor/modelo e versão do prompt/schema.
+# Assim, uma nota idêntica nunca paga OCR nem chamada de IA duas vezes.
+# ==============================================================================
+
+CAMADAS = ("texto", "resultado")
+# A cada N gravações, verifica se é preciso remover entradas antigas/excedentes
+_GRAVACOES_ENTRE_LIMPEZAS = 100
+
+def hash_bytes(dados: bytes) -> str:
+    return hashlib.sha256(dados).hexdigest()
+
+_hashes_arquivos = {}
+_hashes_lock = threading.Lock()
+
+def hash_arquivo(caminho_arquivo: str) -> str:
+    """
+    Calcula o SHA-256 do arquivo em blocos, sem carregá-lo inteiro na memória.
+    O resultado é memorizado por (caminho, tamanho, mtime), pois um mesmo PDF
+    costuma gerar várias tarefas de extração.
+    """
+    info = os.stat(caminho_arquivo)
+    assinatura = (os.path.abspath(caminho_arquivo), info.st_size, info.st_mtime_ns)
+    with _hashes_lock:
+        if assinatura in _hashes_arquivos:
+            return _hashes_arquivos[assinatura]
+    sha = hashlib.sha256()
+    with open(caminho_arquivo, 'rb') as f:
+        for bloco in iter(lambda: f.read(1024 * 1024), b''):
+            sha.update(bloco)
+    with _hashes_lock:
+        _hashes_arquivos[assinatura] = sha.hexdigest()
+    return _hashes_arquivos[assinatura]
+
+def registrar_hash_arquivo(caminho_arquivo: str, sha256: str):
+    """Memoriza um hash já calculado em outra etapa (ex: pelo guardião, durante a descompactação)."""
+    info = os.stat(caminho_arquivo)
+    with _hashes_lock:
+        _hashes_arquivos[(os.path.abspath(caminho_arquivo), info.st_size, info.st_mtime_ns)] = sha256
+
+def montar_chave(*partes) -> str:
+    """Gera uma chave estável a partir de qualquer combinação de valores serializáveis em JSON."""
+    return hash_bytes(json.dumps(partes, sort_keys=True, ensure_ascii=False, default=str).encode('utf-8'))
+
+
+class CacheExtracao:
+    """
+    Cache em SQLite com despejo por idade e por tamanho (menos usado recentemente
+    primeiro). Seguro para uso por várias threads do mesmo processo.
+    """
+
+    def __init__(self, caminho_db: str, max_mb: float = 512, max_dias: float = 90, habilitado: bool = True):
+        self.caminho_db = caminho_db
+        self.max_bytes = int(max_mb * 1024 * 1024) if max_mb else 0
+        self.max_idade = max_dias * 86400 if max_dias else 0
+        self.habilitado = habilitado
+        self._lock = threading.Lock()
+        self._gravacoes = 0
+        self._contadores = {camada: {"hits": 0, "misses": 0} for camada in CAMADAS}
+        self._conexao = None
+        if habilitado:
+            self._abrir()
+
+    def _abrir(self):
+        try:
+            os.makedirs(os.path.dirname(self.caminho_db), exist_ok=True)
+            self._conexao = sqlite3.connect(self.caminho_db, check_same_thread=False, timeout=30)
+            self._conexao.execute("PRAGMA journal_mode=WAL")
+            for camada in CAMADAS:
+                self._conexao.execute(
+                    f"CREATE TABLE IF NOT EXISTS {camada} ("
+                    "chave TEXT PRIMARY KEY, valor TEXT NOT NULL, tamanho INTEGER NOT NULL, "
+                    "criado_em REAL NOT NULL, acessado_em REAL NOT NULL)"
+                )
+            self._conexao.commit()
+            self._limpar()
+        except sqlite3.Error as e:
+            print(f"AVISO: Não foi possível abrir o cache de extração em '{self.caminho_db}'. Seguindo sem cache. Erro: {e}")
+            self._conexao = None
+            self.habilitado = False
+
+    def _obter(self, camada: str, chave: str) -> Optional[str]:
+        with self._lock:
+            if not self.habilitado:
+                return None
+            try:
+                linha = self._conexao.execute(f"SELECT valor, criado_em FROM {camada} WHERE chave = ?", (chave,)).fetchone()
+                agora = time.time()
+                if linha and self.max_idade and agora - linha[1] > self.max_idade:
+                    self._conexao.execute(f"DELETE FROM {camada} WHERE chave = ?", (chave,))
+                    self._conexao.commit()
+                    linha = None
+                if linha is None:
+                    self._contadores[camada]["misses"] += 1
+                    return None
+                self._conexao.execute(f"UPDATE {camada} SET acessado_em = ? WHERE chave = ?", (agora, chave))
+                self._conexao.commit()
+                self._contadores[camada]["hits"] += 1
+                return linha[0]
+            except sqlite3.Error as e:
+                print(f"AVISO: Falha ao ler o cache ({camada}): {e}")
+                self._contadores[camada]["misses"] += 1
+                return None
+
+    def _salvar(self, camada: str, chave: str, valor: str):
+        with self._lock:
+            if not self.habilitado:
+                return
+            try:
+                agora = time.time()
+                self._conexao.execute(
+                    f"INSERT OR REPLACE INTO {camada} (chave, valor, tamanho, criado_em, acessado_em) VALUES (?, ?, ?, ?, ?)",
+                    (chave, valor, len(valor.encode('utf-8')), agora, agora)
+                )
+                self._conexao.commit()
+                self._gravacoes += 1
+                if self._gravacoes % _GRAVACOES_ENTRE_LIMPEZAS == 0:
+                    self._limpar()
+            except sqlite3.Error as e:
+                print(f"AVISO: Falha ao gravar no cache ({camada}): {e}")
+
+    def _limpar(self):
+        """Remove entradas vencidas e, se o cache passou do limite, as menos usadas."""
+        if self.max_idade:
+            limite = time.time() - self.max_idade
+            for camada in CAMADAS:
+                self._conexao.execute(f"DELETE FROM {camada} WHERE criado_em < ?", (limite,))
+        if self.max_bytes:
+            total = sum(self._conexao.execute(f"SELECT COALESCE(SUM(tamanho), 0) FROM {camada}").fetchone()[0] for camada in CAMADAS)
+            if total > self.max_bytes:
+                entradas = self._conexao.execute(
+                    " UNION ALL ".join(f"SELECT '{camada}', chave, tamanho, acessado_em FROM {camada}" for camada in CAMADAS)
+                    + " ORDER BY acessado_em"
+                ).fetchall()
+                for camada, chave, tamanho, _ in entradas:
+                    if total <= self.max_bytes:
+                        break
+                    self._conexao.execute(f"DELETE FROM {camada} WHERE chave = ?", (chave,))
+                    total -= tamanho
+        self._conexao.commit()
+
+    # --- Camada 1: texto bruto ---
+    def obter_texto(self, chave: str) -> Optional[str]:
+        return self._obter("texto", chave)
+
+    def salvar_texto(self, chave: str, texto: str):
+        self._salvar("texto", chave, texto)
+
+    # --- Camada 2: resultado estruturado ---
+    def obter_resultado(self, chave: str) -> Optional[dict]:
+        valor = self._obter("resultado", chave)
+        return json.loads(valor) if valor is not None else None
+
+    def salvar_resultado(self, chave: str, resultado: dict):
+        self._salvar("resultado", chave, json.dumps(resultado, ensure_ascii=False))
+
+    def estatisticas(self) -> dict:
+        """Contadores de acertos/falhas por camada desde a abertura do cache."""
+        with self._lock:
+            return {camada: dict(valores) for camada, valores in self._contadores.items()}
+
+    def fechar(self):
+        """Fecha a conexão SQLite. Depois disso o cache se comporta como desativado."""
+        with self._lock:
+            self.habilitado = False
+            if self._conexao is not None:
+                self._conexao.close()
+                self._conexao = None
+
+
+_cache = None
+_parametros_cache = None
+_cache_lock = threading.Lock()
+
+def obter_cache(config: dict) -> CacheExtracao:
+    """
+    Retorna o cache do processo, recriando-o se a configuração mudou.
+    Com 'cache_habilitado' = False, devolve um cache desativado (sempre 'miss').
+    Ao recriar, a conexão do cache anterior é fechada e os contadores de
+    acertos/falhas recomeçam do zero.
+    """
+    global _cache, _parametros_cache
+    parametros = (
+        config.get("cache_arquivo") or data_path("cache", "extracao.sqlite3"),
+        config.get("cache_max_mb", 512),
+        config.get("cache_max_dias", 90),
+        bool(config.get("cache_habilitado", True)),
+    )
+    with _cache_lock:
+        if _cache is None or parametros != _parametros_cache:
+            if _cache is not None:
+                _cache.fechar()
+            _cache = CacheExtracao(*parametros)
+            _parametros_cache = parametros
+        return _cache
@@ -0,0 +1,166 @@
+# app/cli.py
+
+import argparse
+import json
+import os
+import shutil
+import sys
+import uuid
+from datetime import datetime
+
+from dotenv import load_dotenv
+
+from .config_manager import load_config
+from .path_utils import data_path
+
+# ==============================================================================
+# MODO SEM INTERFACE (LOTE / CRON / FILA DE JOBS)
+# ==============================================================================
+# Executa o mesmo grafo de agentes da interface web e o agente de entrega sobre
+# uma pasta, arquivo compactado ou lista de arquivos. Como não há um analista
+# para validar cada nota, as regras de aprovação vêm do config.json
+# ('aprovacao_automatica'); notas reprovadas ficam fora da entrega e aparecem no
+# relatório do lote.
+#
+# Uso: python -m app <pasta|arquivo.zip|nota.pdf> [...] [--saida PASTA]
+# ==============================================================================
+
+STATUS_APROVADO = "Aprovado"
+
+def _criar_pasta_lote(entradas: list) -> tuple:
+    """Copia as entradas para uma pasta de lote nova (mesmo formato usado pela interface)."""
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    id_lote_uuid = str(uuid.uuid4())
+    nome_pasta_lote = f"lote_{timestamp}_{id_lote_uuid[:8]}"
+    caminho_lote = data_path("temporario", nome_pasta_lote)
+    os.makedirs(caminho_lote, exist_ok=True)
+
+    def _copiar(caminho_origem: str):
+        destino = os.path.join(caminho_lote, os.path.basename(caminho_origem))
+        contador = 1
+        while os.path.exists(destino):
+            destino = os.path.join(caminho_lote, f"{contador}_{os.path.basename(caminho_origem)}")
+            contador += 1
+        shutil.copy(caminho_origem, destino)
+
+    for entrada in entradas:
+        if os.path.isdir(entrada):
+            for raiz, _, arquivos in os.walk(entrada):
+                for nome_arquivo in sorted(arquivos):
+                    _copiar(os.path.join(raiz, nome_arquivo))
+        elif os.path.isfile(entrada):
+            _copiar(entrada)
+        else:
+            print(f"AVISO: Entrada '{entrada}' não encontrada. Ignorando.")
+    return id_lote_uuid, nome_pasta_lote, caminho_lote
+
+def aplicar_regras_aprovacao(resultados: dict, regras: dict) -> dict:
+    """
+    Aprova automaticamente as notas que atendem às regras do config e devolve os
+    motivos de reprovação por nota. Notas com erro de extração nunca são aprovadas.
+    """
+    from .layouts import cnpj_valido, iss_consistente
+    from .delivery import calcular_valor_crf
+
+    motivos_por_nota = {}
+    for id_nota, dados_nota in resultados.items():
+        dados = dados_nota.get("dados_extraidos", {})
+        motivos = []
+        if dados_nota.get("status") == "Erro":
+            motivos.append(dados.get("erro", "Falha na extração."))
+        else:
+            for campo in regras.get("campos_obrigatorios", []):
+                if not str(dados.get(campo) or "").strip():
+                    motivos.append(f"Campo obrigatório vazio: {campo}")
+            if regras.get("exigir_cnpj_valido") and dados.get("prestador_cnpj") and not cnpj_valido(dados["prestador_cnpj"]):
+                motivos.append("CNPJ do prestador inválido")
+            if regras.get("exigir_iss_consistente") and not iss_consistente(dados.get("base_calculo_iss"), dados.get("aliquota_iss"), dados.get("valor_iss")):
+                motivos.append("Base x alíquota não confere com o ISS")
+
+        if not motivos:
+            dados["valor_crf"] = calcular_valor_crf(dados)
+            dados_nota["status"] = STATUS_APROVADO
+        motivos_por_nota[id_nota] = motivos
+    return motivos_por_nota
+
+def processar_em_lote(entradas: list, caminho_saida: str = None) -> dict:
+    """Roda guardião -> segmentador -> extrator -> enriquecimento -> entrega sem a interface."""
+    # Importados sob demanda para que 'python -m app --help' responda sem carregar OCR/LangGraph
+    from .workflow import app_workflow
+    from .graph_state import LoteState
+    from .delivery import agente_entrega_final
+
+    load_dotenv(override=True)
+    config = load_config()
+    id_lote_uuid, nome_pasta_lote, caminho_lote = _criar_pasta_lote(entradas)
+    print(f"\n🚀 PROCESSAMENTO SEM INTERFACE PARA O LOTE: {id_lote_uuid} ({caminho_lote}) 🚀\n")
+
+    initial_state = LoteState(id_lote=id_lote_uuid, caminho_lote=caminho_lote, unidades_de_processamento=[], resultados_extracao={}, armazem_paginas=None, metricas=None, status_geral="Iniciado", erros=[])
+    final_state = app_workflow.invoke(initial_state, {"recursion_limit": 50})
+    resultados = final_state.get("resultados_extracao", {})
+
+    motivos = aplicar_regras_aprovacao(resultados, config.get("aprovacao_automatica", {}))
+
+    caminho_saida = caminho_saida or data_path("saida", nome_pasta_lote)
+    os.makedirs(caminho_saida, exist_ok=True)
+    caminhos_finais = agente_entrega_final(resultados, caminho_saida, final_state.get("metricas"))
+    if final_state.get("metricas"):
+        caminhos_finais.update(final_state["metricas"].exportar(caminho_saida))
+
+    relatorio = {
+        "id_lote": id_lote_uuid,
+        "caminho_lote": caminho_lote,
+        "total_notas": len(resultados),
+        "aprovadas": sum(1 for d in resultados.values() if d.get("status") == STATUS_APROVADO),
+        "arquivos_gerados": caminhos_finais,
+        "erros": final_state.get("erros", []),
+        "metricas": final_state["metricas"].resumo() if final_state.get("metricas") else None,
+        "notas": {
+            id_nota: {
+                "arquivo_original": dados_nota.get("info_arquivo", {}).get("nome_original"),
+                "nomes_origem": dados_nota.get("info_arquivo", {}).get("nomes_origem", []),
+                "status": dados_nota.get("status"),
+                "motivos_reprovacao": motivos.get(id_nota, []),
+                "dados_extraidos": dados_nota.get("dados_extraidos", {}),
+            }
+            for id_nota, dados_nota in resultados.items()
+        },
+    }
+    caminho_relatorio = os.path.join(caminho_saida, "relatorio_lote.json")
+    with open(caminho_relatorio, 'w', encoding='utf-8') as f:
+        json.dump(relatorio, f, indent=2, ensure_ascii=False, default=str)
+    relatorio["arquivos_gerados"]["relatorio"] = caminho_relatorio
+    return relatorio
+
+def main(argv: list = None) -> int:
+    parser = argparse.ArgumentParser(
+        prog="python -m app",
+        description="SYNFST - processa um lote de notas fiscais sem a interface web."
+    )
+    parser.add_argument("entradas", nargs="+", help="Pastas, arquivos compactados (.zip/.rar), PDFs ou imagens das notas.")
+    parser.add_argument("--saida", help="Pasta onde os arquivos de entrega serão gravados (padrão: dados/saida/<lote>).")
+    args = parser.parse_args(argv)
+
+    if not any(os.path.exists(entrada) for entrada in args.entradas):
+        print(f"Erro: nenhuma das entradas foi encontrada: {', '.join(args.entradas)}", file=sys.stderr)
+        return 1
+
+    try:
+        relatorio = processar_em_lote(args.entradas, args.saida)
+    except Exception as e:
+        import traceback
+        traceback.print_exc()
+        print(f"Erro crítico: {e}", file=sys.stderr)
+        return 1
+
+    if relatorio["total_notas"] == 0:
+        # Um lote vazio não é sucesso: o cron precisa distinguir de uma execução limpa
+        print(f"Erro: nenhuma nota foi encontrada nas entradas. Relatório: {relatorio['arquivos_gerados'].get('relatorio')}", file=sys.stderr)
+        return 1
+
+    print(f"\n🏁 LOTE FINALIZADO: {relatorio['aprovadas']}/{relatorio['total_notas']} notas aprovadas automaticamente. 🏁")
+    for nome, caminho in relatorio["arquivos_gerados"].items():
+        if caminho:
+            print(f"  - {nome}: {caminho}")
+    # Código 2: o lote rodou, mas há notas aguardando validação manual
+    return 0 if relatorio["aprovadas"] == relatorio["total_notas"] else 2
@@ -0,0 +1,123 @@
+# app/concurrency.py
+
+import random
+import threading
+import time
+from typing import Callable, Optional
+
+from langchain_core.exceptions import OutputParserException
+from pydantic import ValidationError
+
+from .config_manager import get_provider_limits
+
+# ==============================================================================
+# LIMITADOR DE TAXA POR PROVEDOR
+# ==============================================================================
+# Cada provedor de IA tem um limite de chamadas simultâneas (semáforo) e um
+# limite de requisições por minuto (espaçamento mínimo entre o início de duas
+# chamadas). O mesmo limitador é compartilhado por todas as threads do lote.
+# ==============================================================================
+
+class LimitadorDeTaxa:
+    """Controla concorrência e requisições por minuto de um único provedor."""
+
+    def __init__(self, concorrencia: int, rpm: int):
+        self.concorrencia = concorrencia
+        self.rpm = rpm
+        self._semaforo = threading.BoundedSemaphore(concorrencia)
+        self._lock = threading.Lock()
+        self._intervalo = 60.0 / rpm if rpm else 0.0
+        self._proximo_inicio = 0.0
+
+    def _aguardar_vez(self):
+        if not self._intervalo:
+            return
+        with self._lock:
+            agora = time.monotonic()
+            inicio = max(agora, self._proximo_inicio)
+            self._proximo_inicio = inicio + self._intervalo
+        espera = inicio - time.monotonic()
+        if espera > 0:
+            time.sleep(espera)
+
+    def __enter__(self):
+        self._semaforo.acquire()
+        self._aguardar_vez()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self._semaforo.release()
+        return False
+
+
+_limitadores = {}
+_limitadores_lock = threading.Lock()
+
+def obter_limitador(provider: str, config: dict = None) -> LimitadorDeTaxa:
+    """
+    Retorna o limitador do provedor, criando-o na primeira chamada. Se os limites
+    configurados mudarem, um novo limitador substitui o anterior.
+    """
+    limites = get_provider_limits(provider, config)
+    with _limitadores_lock:
+        limitador = _limitadores.get(provider)
+        if limitador is None or (limitador.concorrencia, limitador.rpm) != (limites["concorrencia"], limites["rpm"]):
+            limitador = LimitadorDeTaxa(limites["concorrencia"], limites["rpm"])
+            _limitadores[provider] = limitador
+        return limitador
+
+# ==============================================================================
+# RETENTATIVA COM BACKOFF EXPONENCIAL
+# ==============================================================================
+# Os SDKs dos provedores levantam exceções diferentes para o mesmo problema
+# (ex: RateLimitError, ResourceExhausted, APIStatusError). Por isso a decisão
+# usa o código de status HTTP dos atributos mais comuns e, sem ele, o nome das
+# classes de erro transitório dos SDKs. A mensagem do erro nunca é usada: em
+# falhas de parse ela contém a resposta do modelo (cheia de valores como
+# '528,20'), e repetir a chamada só cobraria o provedor de novo.
+# ==============================================================================
+
+# Classes (em qualquer nível da hierarquia) que indicam limite de taxa,
+# indisponibilidade ou timeout nos SDKs dos provedores e nas bibliotecas HTTP
+_CLASSES_ERRO_TRANSITORIO = {
+    "RateLimitError", "TooManyRequests", "ResourceExhausted",
+    "ServiceUnavailable", "InternalServerError", "OverloadedError", "APIConnectionError",
+    "APITimeoutError", "DeadlineExceeded", "Timeout", "TimeoutException", "ReadTimeout",
+    "ConnectTimeout", "TimeoutError",
+}
+
+def _codigo_status(erro: Exception) -> Optional[int]:
+    for origem in (erro, getattr(erro, "response", None)):
+        for atributo in ("status_code", "status", "code", "http_status"):
+            valor = getattr(origem, atributo, None)
+            if isinstance(valor, int):
+                return valor
+    return None
+
+def erro_transitorio(erro: Exception) -> bool:
+    """Indica se o erro é um 429/5xx (ou equivalente) que vale a pena repetir."""
+    # Resposta fora do schema não melhora repetindo a mesma chamada
+    if isinstance(erro, (OutputParserException, ValidationError)):
+        return False
+    status = _codigo_status(erro)
+    if status is not None:
+        return status == 429 or 500 <= status < 600
+    return any(classe.__name__ in _CLASSES_ERRO_TRANSITORIO for classe in type(erro).__mro__)
+
+def executar_com_retentativa(funcao: Callable, max_tentativas: int = 5, backoff_inicial: float = 2.0, backoff_maximo: float = 60.0, descricao: str = "chamada"):
+    """
+    Executa 'funcao' repetindo-a em erros transitórios, com backoff exponencial
+    e jitter. Erros não transitórios (ex: resposta fora do schema) sobem direto.
+    """
+    tentativa = 1
+    while True:
+        try:
+            return funcao()
+        except Exception as e:
+            if tentativa >= max_tentativas or not erro_transitorio(e):
+                raise
+            espera = min(backoff_maximo, backoff_inicial * (2 ** (tentativa - 1)))
+            espera = espera * (0.5 + random.random() / 2)
+            print(f"  - AVISO: {descricao} falhou (tentativa {tentativa}/{max_tentativas}): {e}. Nova tentativa em {espera:.1f}s...")
+            time.sleep(espera)
+            tentativa += 1
@@ -1,5 +1,6 @@
 # config_manager.py
 
+import copy
 import json
 import os
 from dotenv import dotenv_values, set_key
@@ -15,33 +16,40 @@ AVAILABLE_MODELS = {
     "google": {
         "models": ["gemini-2.5-flash", "gemini-2.5-pro"], # Nomes para a nova API
         "api_key_name": "GOOGLE_API_KEY",
-        "extra_vars": []  # <--- LINHA ALTERADA: Não exige mais o GCP_PROJECT
+        "extra_vars": [],  # <--- LINHA ALTERADA: Não exige mais o GCP_PROJECT
+        "limites": {"concorrencia": 4, "rpm": 60}
     },
     "openai": {
         "models": ["gpt-4o", "gpt-4-turbo"],
         "api_key_name": "OPENAI_API_KEY",
-        "extra_vars": []
+        "extra_vars": [],
+        "limites": {"concorrencia": 8, "rpm": 300}
     },
     "anthropic": {
         "models": ["claude-3-5-sonnet-20240620", "claude-3-opus-20240229"],
         "api_key_name": "ANTHROPIC_API_KEY",
-        "extra_vars": []
+        "extra_vars": [],
+        "limites": {"concorrencia": 4, "rpm": 50}
     },
     "mistral": {
         "models": ["mistral-large-latest", "open-mistral-nemo"],
         "api_key_name": "MISTRAL_API_KEY",
-        "extra_vars": []
+        "extra_vars": [],
+        "limites": {"concorrencia": 2, "rpm": 60}
     },
     "groq": {
         "models": ["llama3-70b-8192", "mixtral-8x7b-32768"],
         "api_key_name": "GROQ_API_KEY",
-        "extra_vars": []
+        "extra_vars": [],
+        "limites": {"concorrencia": 4, "rpm": 30}
     },
     # --- NOVO PROVEDOR: OLLAMA ---
     "ollama": {
         "models": ["llama3", "phi3", "mistral"], # Modelos comuns como exemplo
         "api_key_name": None, # Ollama local não requer chave de API
-        "extra_vars": ["OLLAMA_BASE_URL"] # A URL do servidor é a configuração principal
+        "extra_vars": ["OLLAMA_BASE_URL"], # A URL do servidor é a configuração principal
+        # Servidor local: uma requisição por vez e sem limite de RPM (0 = ilimitado)
+        "limites": {"concorrencia": 1, "rpm": 0}
     }
 }
 
@@ -49,29 +57,90 @@ DEFAULT_CONFIG = {
     "provider": "google",
     "model": "gemini-2.5-flash",
     "custom_model": "",
-    "acum_mapping_file": None
+    "acum_mapping_file": None,
+    # --- Extração concorrente ---
+    # Quando desativada, o nó extrator processa uma nota por vez (comportamento antigo).
+    "extracao_paralela": True,
+    # Número de processos para o OCR. None = um processo por núcleo da CPU.
+    "ocr_processos": None,
+    # Sobrescreve os limites padrão de AVAILABLE_MODELS por provedor.
+    # Ex: {"google": {"concorrencia": 8, "rpm": 120}}
+    "limites_provedores": {},
+    # Retentativas para respostas 429/5xx dos provedores de IA.
+    "llm_max_tentativas": 5,
+    "llm_backoff_inicial": 2.0,
+    # --- Cache persistente de OCR e resultados da IA (dados/cache) ---
+    # Desative para forçar nova extração de todas as notas.
+    "cache_habilitado": True,
+    "cache_max_mb": 512,
+    "cache_max_dias": 90,
+    # Memória máxima do armazém de texto por página do lote; o excedente vai para disco.
+    "paginas_max_mb_memoria": 64,
+    # Caminho rápido: layouts municipais conhecidos são lidos por regras (app/layouts.py)
+    # e o LLM só é consultado para campos ausentes ou reprovados nas verificações.
+    "layouts_habilitados": True,
+    # Regras do modo sem interface (python -m app): notas que as atendem são
+    # aprovadas e exportadas; as demais ficam no relatório para validação manual.
+    "aprovacao_automatica": {
+        "campos_obrigatorios": ["prestador_cnpj", "numero_nf", "data_emissao", "valor_total"],
+        "exigir_cnpj_valido": True,
+        "exigir_iss_consistente": False
+    },
+    # Entrega: além do .zip, grava uma cópia de cada nota renomeada na pasta de saída
+    "entrega_manter_arquivos_soltos": True,
+    # Limites da entrada do lote (guardião). Arquivos que os violam são ignorados e relatados.
+    "limites_entrada": {
+        "tamanho_total_max_mb": 2048,
+        "tamanho_membro_max_mb": 200,
+        "membros_max": 5000,
+        "profundidade_max": 3,
+        "taxa_compressao_max": 100
+    }
 }
 
 # --- Funções de Gerenciamento ---
 
-def load_config() -> dict:
-    # (Função sem alterações, apenas ajustada para usar o novo default)
+def _ler_config_do_arquivo() -> dict:
+    """Conteúdo do config.json como está no disco, sem os padrões. {} se ausente ou inválido."""
     if not os.path.exists(CONFIG_FILE):
-        return DEFAULT_CONFIG.copy()
+        return {}
     try:
         with open(CONFIG_FILE, 'r', encoding='utf-8') as f:
             config = json.load(f)
-            # Garante que as chaves mais recentes existam no arquivo de config
-            for key, value in DEFAULT_CONFIG.items():
-                config.setdefault(key, value)
-            return config
+        return config if isinstance(config, dict) else {}
     except (json.JSONDecodeError, FileNotFoundError):
-        return DEFAULT_CONFIG.copy()
+        return {}
+
+def load_config() -> dict:
+    config = _ler_config_do_arquivo()
+    # Garante que as chaves mais recentes existam na config em memória. Cópia profunda:
+    # quem altera um dicionário aninhado não pode alterar o DEFAULT_CONFIG do módulo.
+    for key, value in DEFAULT_CONFIG.items():
+        if key not in config:
+            config[key] = copy.deepcopy(value)
+    return config
 
 def save_config(provider: str, model: str, custom_model: str = "", acum_mapping_file: str = None):
-    # (Função sem alterações)
+    # Atualiza só as chaves da interface sobre o arquivo bruto: os padrões não são
+    # gravados, para que mudanças de padrão em versões futuras cheguem às instalações.
+    config = _ler_config_do_arquivo()
+    config.update({"provider": provider, "model": model, "custom_model": custom_model, "acum_mapping_file": acum_mapping_file})
     with open(CONFIG_FILE, 'w', encoding='utf-8') as f:
-        json.dump({"provider": provider, "model": model, "custom_model": custom_model, "acum_mapping_file": acum_mapping_file}, f, indent=2)
+        json.dump(config, f, indent=2)
+
+def get_provider_limits(provider: str, config: dict = None) -> dict:
+    """
+    Retorna os limites de concorrência e requisições por minuto (RPM) do provedor,
+    combinando os padrões de AVAILABLE_MODELS com as sobrescritas do config.json.
+    Um 'rpm' igual a 0 significa sem limite.
+    """
+    config = config or load_config()
+    limites = {"concorrencia": 1, "rpm": 0}
+    limites.update(AVAILABLE_MODELS.get(provider, {}).get("limites", {}))
+    limites.update((config.get("limites_provedores") or {}).get(provider, {}))
+    limites["concorrencia"] = max(1, int(limites.get("concorrencia") or 1))
+    limites["rpm"] = max(0, int(limites.get("rpm") or 0))
+    return limites
 
 def get_env_vars() -> dict:
     # (Função sem alterações)
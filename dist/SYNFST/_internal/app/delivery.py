@@ -1,18 +1,19 @@
 import os
+import csv
+import fitz
 import pandas as pd
 import shutil
 import zipfile
 import re
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
+from itertools import chain
+from openpyxl import Workbook
 from dotenv import load_dotenv
 
 from .config_manager import load_config
-from langchain_google_vertexai import ChatVertexAI
-from langchain_openai import ChatOpenAI
-from langchain_anthropic import ChatAnthropic
-from langchain_mistralai import ChatMistralAI
-from langchain_groq import ChatGroq
-from langchain_community.chat_models import ChatOllama
+from .providers import obter_modelo_chat
+from .metrics import tamanho_arquivos
 from langchain_core.prompts import ChatPromptTemplate
 from langchain_core.output_parsers import JsonOutputParser
 
@@ -95,129 +96,178 @@ def _formatar_aliquota_brl(valor) -> str:
     # Alíquotas geralmente não precisam de separador de milhar.
     return f'{valor_float:.2f}'.replace('.', ',')
 
+def _converter_valor_para_calculo(valor) -> float:
+    """Converte um valor digitado/extraído para float, tratando vazios e lixo como zero."""
+    if valor is None: return 0.0
+    if isinstance(valor, (int, float)): return float(valor)
+    valor_str = str(valor).strip()
+    if not valor_str: return 0.0
+    valor_limpo = re.sub(r'[^\d,.-]', '', valor_str).replace('.', '').replace(',', '.')
+    try:
+        return float(valor_limpo)
+    except (ValueError, TypeError):
+        return 0.0
+
+def calcular_valor_crf(dados: dict) -> str:
+    """CRF = PIS + COFINS + CSLL, no formato usado pela planilha de importação (ex: 12,34)."""
+    crf = sum(_converter_valor_para_calculo(dados.get(campo)) for campo in ("valor_pis", "valor_cofins", "valor_csll"))
+    return f"{crf:.2f}".replace('.', ',')
+
 # --- FUNÇÕES DE GERAÇÃO DE ARQUIVOS ---
 
-def renomear_e_mover_arquivos(estado_do_lote: dict, caminho_saida_lote: str) -> list:
-    """
-    Renomeia os arquivos de nota fiscal com base nos dados extraídos e os move para a pasta de saída.
-    Formato: <CNPJ_PRESTADOR>_<NUMERO_NF>_<DATA_EMISSAO>.ext
-    """
-    arquivos_renomeados = []
+def _nome_arquivo_nota(dados: dict, info_arquivo: dict) -> str:
+    """Formato: <CNPJ_PRESTADOR>_<NUMERO_NF>_<DATA_EMISSAO>.ext"""
+    # --- CORREÇÃO: Usando CNPJ do PRESTADOR ---
+    # Campos presentes com valor None (comum na aprovação automática) também usam o marcador
+    cnpj = _limpar_cnpj(dados.get("prestador_cnpj")) or "SEM_CNPJ"
+    numero_nf = str(dados.get("numero_nf") or "SEM_NUM").replace("/", "-")
+    data = str(dados.get("data_emissao") or "SEM_DATA").replace("/", "-")
+
+    # A extensão padronizada vem do tipo detectado pelo conteúdo; o nome original pode
+    # não ter extensão (ou ter o sufixo de páginas adicionado para a interface)
+    _, extensao = os.path.splitext(info_arquivo.get("nome_padronizado") or info_arquivo["nome_original"])
+
+    # Garante que a extensão seja minúscula e válida
+    extensao = extensao.lower() if extensao else ".pdf"
+
+    # Limpa caracteres inválidos para nomes de arquivo
+    numero_nf_limpo = re.sub(r'[\\/*?:"<>|]', "-", str(numero_nf))
+    data_limpa = re.sub(r'[\\/*?:"<>|]', "-", str(data))
+
+    return f"{cnpj}_{numero_nf_limpo}_{data_limpa}{extensao}"
+
+def _nome_unico(nome: str, nomes_usados: set) -> str:
+    # Duas notas com o mesmo CNPJ/número/data não podem sobrescrever uma à outra no .zip
+    base, extensao = os.path.splitext(nome)
+    contador = 2
+    while nome in nomes_usados:
+        nome = f"{base}_{contador}{extensao}"
+        contador += 1
+    nomes_usados.add(nome)
+    return nome
+
+def _agrupar_notas_aprovadas_por_origem(estado_do_lote: dict) -> dict:
+    """Agrupa as notas aprovadas pelo arquivo de origem, para que cada arquivo seja aberto uma única vez."""
+    grupos = {}
     for id_nota, dados_nota in estado_do_lote.items():
         if dados_nota.get("status") != "Aprovado":
             continue
+        grupos.setdefault(dados_nota["info_arquivo"]["caminho"], []).append(dados_nota)
+    return grupos
 
-        dados = dados_nota["dados_extraidos"]
-        info_arquivo = dados_nota["info_arquivo"]
-        caminho_original = info_arquivo["caminho"]
-        
-        # --- CORREÇÃO: Usando CNPJ do PRESTADOR ---
-        cnpj = _limpar_cnpj(dados.get("prestador_cnpj", "SEM_CNPJ"))
-        numero_nf = dados.get("numero_nf", "SEM_NUM").replace("/", "-")
-        data = dados.get("data_emissao", "SEM_DATA").replace("/", "-")
-        
-        _, extensao = os.path.splitext(info_arquivo["nome_original"])
-        
-        # Garante que a extensão seja minúscula e válida
-        extensao = extensao.lower() if extensao else ".pdf"
-
-        # Limpa caracteres inválidos para nomes de arquivo
-        numero_nf_limpo = re.sub(r'[\\/*?:"<>|]', "-", str(numero_nf))
-        data_limpa = re.sub(r'[\\/*?:"<>|]', "-", str(data))
-
-        novo_nome = f"{cnpj}_{numero_nf_limpo}_{data_limpa}{extensao}"
-        novo_caminho = os.path.join(caminho_saida_lote, novo_nome)
-        
-        try:
-            # Copia a nota inteira se não houver páginas, ou recria o PDF apenas com as páginas certas
-            paginas = info_arquivo.get("paginas")
-            if paginas and caminho_original.lower().endswith(".pdf"):
-                with fitz.open(caminho_original) as doc_origem:
-                    with fitz.open() as doc_destino:
-                        # fitz é 0-indexado, nossas páginas são 1-indexadas
-                        paginas_para_inserir = [p - 1 for p in paginas]
-                        doc_destino.insert_pdf(doc_origem, from_page=min(paginas_para_inserir), to_page=max(paginas_para_inserir))
-                        doc_destino.save(novo_caminho)
-            else:
-                shutil.copy(caminho_original, novo_caminho)
-
-            arquivos_renomeados.append(novo_caminho)
-        except Exception as e:
-            print(f"Erro ao mover/recriar o arquivo {caminho_original}: {e}")
-            
-    return arquivos_renomeados
-
-
-def gerar_planilhas_importacao(estado_do_lote: dict, caminho_saida_lote: str) -> dict:
+def gerar_zip_das_notas(estado_do_lote: dict, caminho_saida_lote: str, manter_arquivos_soltos: bool = True) -> tuple:
     """
-    Gera as planilhas .xlsx e .csv no padrão de importação (Domínio), com ajustes no CSV.
+    Renomeia as notas aprovadas e as grava direto no .zip, em uma única passada:
+    cada PDF de origem é aberto uma vez e todas as suas notas são recortadas em
+    memória ('tobytes'), sem gravar e reler arquivos intermediários. Com
+    'manter_arquivos_soltos', uma cópia de cada nota também fica na pasta de saída.
+    Retorna (caminho do .zip ou None, lista das cópias soltas).
     """
-    lista_para_df = []
+    grupos = _agrupar_notas_aprovadas_por_origem(estado_do_lote)
+    if not grupos:
+        return None, []
+
+    caminho_zip = os.path.join(caminho_saida_lote, "notas_fiscais_renomeadas.zip")
+    arquivos_renomeados = []
+    nomes_usados = set()
+
+    with zipfile.ZipFile(caminho_zip, 'w', zipfile.ZIP_DEFLATED) as zipf:
+        for caminho_original, notas in grupos.items():
+            try:
+                doc_origem = fitz.open(caminho_original) if caminho_original.lower().endswith(".pdf") else None
+            except Exception as e:
+                print(f"Erro ao abrir o arquivo {caminho_original}: {e}")
+                continue
+            try:
+                for dados_nota in notas:
+                    # Uma nota com problema fica de fora sem interromper o restante do .zip
+                    try:
+                        novo_nome = _nome_unico(_nome_arquivo_nota(dados_nota["dados_extraidos"], dados_nota["info_arquivo"]), nomes_usados)
+                        novo_caminho = os.path.join(caminho_saida_lote, novo_nome)
+                        # Recria o PDF apenas com as páginas certas, ou usa a nota inteira se não houver páginas
+                        paginas = dados_nota["info_arquivo"].get("paginas")
+                        if paginas and doc_origem is not None:
+                            with fitz.open() as doc_destino:
+                                # fitz é 0-indexado, nossas páginas são 1-indexadas
+                                paginas_para_inserir = [p - 1 for p in paginas]
+                                doc_destino.insert_pdf(doc_origem, from_page=min(paginas_para_inserir), to_page=max(paginas_para_inserir))
+                                conteudo = doc_destino.tobytes()
+                            zipf.writestr(novo_nome, conteudo)
+                            if manter_arquivos_soltos:
+                                with open(novo_caminho, 'wb') as f:
+                                    f.write(conteudo)
+                        else:
+                            zipf.write(caminho_original, novo_nome)
+                            if manter_arquivos_soltos:
+                                shutil.copy(caminho_original, novo_caminho)
+
+                        if manter_arquivos_soltos:
+                            arquivos_renomeados.append(novo_caminho)
+                    except Exception as e:
+                        print(f"Erro ao mover/recriar o arquivo {caminho_original}: {e}")
+            finally:
+                if doc_origem is not None:
+                    doc_origem.close()
+
+    return caminho_zip, arquivos_renomeados
+
+
+COLUNAS_IMPORTACAO = [
+    "Data Emissão", "Número", "Cód.", "Item", "Acum", "Aliq.(%)", "Base(R$)", "ISS", "CR", "IR", "INSS",
+    "Valor(R$)", "CNPJ Prest.", "Razão Prest.", "UF"
+]
+
+def _linhas_importacao(estado_do_lote: dict):
+    """Gera, nota a nota, as linhas da planilha de importação (na ordem de COLUNAS_IMPORTACAO)."""
     for id_nota, dados_nota in estado_do_lote.items():
         if dados_nota.get("status") != "Aprovado":
             continue
-            
+
         dados = dados_nota["dados_extraidos"]
 
-        # Formata a data para o padrão DD/MM/AAAA
-        data_formatada = _formatar_data_br(dados.get("data_emissao"))
-
-        linha = {
-            "Data Emissão": data_formatada,
-            "Número": dados.get("numero_nf"),
-            "Cód.": dados.get("codigo_servico"),
-            "Item": dados.get("item", ""), # Usa o valor que foi pré-preenchido e validado pelo usuário
-            "Acum": dados.get("acum", ""), # Usa o valor salvo pelo usuário, se houver
-            "Aliq.(%)": _formatar_aliquota_brl(dados.get("aliquota_iss")),
-            "Base(R$)": _formatar_valor_brl(dados.get("base_calculo_iss")),
-            "ISS": _formatar_valor_brl(dados.get("valor_iss")),
-            "CR": _formatar_valor_brl(dados.get("valor_crf")), # CRF (PIS+COFINS+CSLL) calculado automaticamente
-            "IR": _formatar_valor_brl(dados.get("valor_ir")),
-            "INSS": _formatar_valor_brl(dados.get("valor_inss")),
-            "Valor(R$)": _formatar_valor_brl(dados.get("valor_total")),
-            "CNPJ Prest.": _limpar_cnpj(dados.get("prestador_cnpj", "")),
-            "Razão Prest.": dados.get("prestador_razao_social"),
-            "UF": dados.get("prestador_uf"),
-        }
-        lista_para_df.append(linha)
-
-    if not lista_para_df:
-        # Se não houver dados, cria arquivos vazios com cabeçalho para não dar erro no download
-        colunas_importacao = [
-            "Data Emissão", "Número", "Cód.", "Item", "Acum", "Aliq.(%)", "Base(R$)", "ISS", "CR", "IR", "INSS", 
-            "Valor(R$)", "CNPJ Prest.", "Razão Prest.", "UF"
+        yield [
+            _formatar_data_br(dados.get("data_emissao")),  # Formata a data para o padrão DD/MM/AAAA
+            dados.get("numero_nf"),
+            dados.get("codigo_servico"),
+            dados.get("item", ""), # Usa o valor que foi pré-preenchido e validado pelo usuário
+            dados.get("acum", ""), # Usa o valor salvo pelo usuário, se houver
+            _formatar_aliquota_brl(dados.get("aliquota_iss")),
+            _formatar_valor_brl(dados.get("base_calculo_iss")),
+            _formatar_valor_brl(dados.get("valor_iss")),
+            _formatar_valor_brl(dados.get("valor_crf")), # CRF (PIS+COFINS+CSLL) calculado automaticamente
+            _formatar_valor_brl(dados.get("valor_ir")),
+            _formatar_valor_brl(dados.get("valor_inss")),
+            _formatar_valor_brl(dados.get("valor_total")),
+            _limpar_cnpj(dados.get("prestador_cnpj", "")),
+            dados.get("prestador_razao_social"),
+            dados.get("prestador_uf"),
         ]
-        df = pd.DataFrame(columns=colunas_importacao)
-    else:
-        df = pd.DataFrame(lista_para_df)
 
+def gerar_planilhas_importacao(estado_do_lote: dict, caminho_saida_lote: str) -> dict:
+    """
+    Gera as planilhas .xlsx, .csv e .txt no padrão de importação (Domínio) em uma
+    única passada sobre as notas. O .xlsx é gravado em modo 'write_only' (streaming)
+    e o .txt recebe as mesmas linhas do .csv, sem cópia posterior. Sem notas
+    aprovadas, os arquivos saem só com o cabeçalho para não dar erro no download.
+    """
     caminho_base = os.path.join(caminho_saida_lote, "planilha_importacao_dominio")
     caminho_xlsx = f"{caminho_base}.xlsx"
     caminho_csv = f"{caminho_base}.csv"
-    
-    df.to_excel(caminho_xlsx, index=False)
-    # Os dados já estão como strings formatadas, então não precisamos do parâmetro 'decimal'.
-    df.to_csv(caminho_csv, index=False, sep=';', encoding='utf-8')
-    
-    return {"xlsx_importacao": caminho_xlsx, "csv_importacao": caminho_csv}
-
-# ==============================================================================
-# NOVA FUNÇÃO 1: CONVERSÃO DE CSV PARA TXT
-# ==============================================================================
-def gerar_txt_de_csv(caminho_csv: str | None, caminho_saida_lote: str) -> str | None:
-    """
-    Lê um arquivo .csv e o salva como .txt.
-    """
-    if not caminho_csv or not os.path.exists(caminho_csv):
-        return None
-        
-    caminho_base = os.path.splitext(os.path.basename(caminho_csv))[0]
-    caminho_txt = os.path.join(caminho_saida_lote, f"{caminho_base}.txt")
-    
-    # Simplesmente copia o conteúdo, pois o CSV já está formatado com ponto e vírgula
-    shutil.copy(caminho_csv, caminho_txt)
-    
-    return caminho_txt
+    caminho_txt = f"{caminho_base}.txt"
+
+    workbook = Workbook(write_only=True)
+    planilha = workbook.create_sheet("Sheet1")
+    # Os dados já estão como strings formatadas, então não há conversão decimal a fazer.
+    with open(caminho_csv, 'w', encoding='utf-8', newline='') as arquivo_csv, \
+         open(caminho_txt, 'w', encoding='utf-8', newline='') as arquivo_txt:
+        escritores = [csv.writer(arquivo, delimiter=';', lineterminator=os.linesep) for arquivo in (arquivo_csv, arquivo_txt)]
+        for linha in chain([COLUNAS_IMPORTACAO], _linhas_importacao(estado_do_lote)):
+            planilha.append(linha)
+            for escritor in escritores:
+                escritor.writerow(linha)
+    workbook.save(caminho_xlsx)
+
+    return {"xlsx_importacao": caminho_xlsx, "csv_importacao": caminho_csv, "txt_importacao": caminho_txt}
 
 # ==============================================================================
 # FUNÇÃO DE MAPEAMENTO DE COLUNAS COM IA
@@ -230,22 +280,8 @@ def _mapear_colunas_com_ia(colunas_extras: list, colunas_padrao: list) -> dict:
         provider = config.get("provider")
         model_name_config = config.get("custom_model", "").strip() or config.get("model")
 
-        model = None
-        if provider == 'google':
-            model = ChatVertexAI(model_name=model_name_config, project=os.getenv("GCP_PROJECT"), temperature=0.0)
-        elif provider == 'openai':
-            model = ChatOpenAI(model_name=model_name_config, temperature=0.0, api_key=os.getenv("OPENAI_API_KEY"))
-        elif provider == 'anthropic':
-            model = ChatAnthropic(model_name=model_name_config, temperature=0.0, api_key=os.getenv("ANTHROPIC_API_KEY"))
-        elif provider == 'mistral':
-            model = ChatMistralAI(model_name=model_name_config, temperature=0.0, api_key=os.getenv("MISTRAL_API_KEY"))
-        elif provider == 'groq':
-            model = ChatGroq(model_name=model_name_config, temperature=0.0, api_key=os.getenv("GROQ_API_KEY"))
-        elif provider == 'ollama':
-            model = ChatOllama(model=model_name_config, base_url=os.getenv("OLLAMA_BASE_URL"), temperature=0.0)
-
-        if not model:
-            raise ValueError(f"Provedor '{provider}' não suportado para mapeamento de colunas.")
+        # Mesmo cliente (e mesmo provedor Google) usado na extração
+        model = obter_modelo_chat(provider, model_name_config)
 
         parser = JsonOutputParser()
         prompt = ChatPromptTemplate.from_messages([
@@ -378,50 +414,35 @@ def gerar_excel_completo(estado_do_lote: dict, caminho_saida_lote: str) -> str |
     
     return caminho_xlsx_completo
 
-def criar_zip_das_notas(caminho_saida_lote: str, lista_arquivos_renomeados: list) -> str | None:
-    """
-    Cria um arquivo .zip contendo todas as notas fiscais renomeadas.
-    Retorna o caminho para o arquivo .zip ou None se não houver arquivos para compactar.
-    """
-    if not lista_arquivos_renomeados:
-        return None
-
-    caminho_zip = os.path.join(caminho_saida_lote, "notas_fiscais_renomeadas.zip")
-    
-    with zipfile.ZipFile(caminho_zip, 'w', zipfile.ZIP_DEFLATED) as zipf:
-        for caminho_arquivo in lista_arquivos_renomeados:
-            if os.path.exists(caminho_arquivo):
-                zipf.write(caminho_arquivo, os.path.basename(caminho_arquivo))
-    
-    return caminho_zip
-
 # ==============================================================================
 # NOVA FUNÇÃO ORQUESTRADORA
 # ==============================================================================
-def agente_entrega_final(estado_do_lote: dict, caminho_saida_lote: str) -> dict:
+def agente_entrega_final(estado_do_lote: dict, caminho_saida_lote: str, coletor=None) -> dict:
     """
     Orquestra todas as etapas de entrega: renomear, gerar planilhas, converter e compactar.
     Esta é a única função que o main.py precisará chamar.
     """
-    # 1. Renomear e mover arquivos
-    arquivos_renomeados = renomear_e_mover_arquivos(estado_do_lote, caminho_saida_lote)
-    
-    # 2. Gerar planilhas de importação (XLSX e CSV com vírgula)
-    caminhos_planilhas_imp = gerar_planilhas_importacao(estado_do_lote, caminho_saida_lote)
-    
-    # 3. Gerar .txt a partir do .csv
-    caminho_txt = gerar_txt_de_csv(caminhos_planilhas_imp.get("csv_importacao"), caminho_saida_lote)
-    
-    # 4. A geração do excel de auditoria foi removida conforme solicitado.
-    # caminho_xlsx_completo = gerar_excel_completo(estado_do_lote, caminho_saida_lote)
-    
-    # 5. Criar ZIP das notas renomeadas
-    caminho_zip = criar_zip_das_notas(caminho_saida_lote, arquivos_renomeados)
-    
-    # 6. Retornar um dicionário com todos os caminhos dos arquivos gerados
+    config = load_config()
+    manter_arquivos_soltos = config.get("entrega_manter_arquivos_soltos", True)
+
+    # O .zip das notas e as planilhas de importação são independentes: rodam em paralelo.
+    # (A geração do excel de auditoria foi removida conforme solicitado.)
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        # 1. Renomear as notas e gravá-las direto no ZIP (cópias soltas opcionais)
+        futuro_zip = executor.submit(gerar_zip_das_notas, estado_do_lote, caminho_saida_lote, manter_arquivos_soltos)
+        # 2. Gerar planilhas de importação (XLSX, CSV e TXT com ponto e vírgula)
+        futuro_planilhas = executor.submit(gerar_planilhas_importacao, estado_do_lote, caminho_saida_lote)
+        caminho_zip, arquivos_renomeados = futuro_zip.result()
+        caminhos_planilhas_imp = futuro_planilhas.result()
+
+    arquivos_origem = _agrupar_notas_aprovadas_por_origem(estado_do_lote).keys()
+    if coletor is not None:
+        coletor.registrar_io("entrega", tamanho_arquivos(arquivos_origem), tamanho_arquivos([caminho_zip, *arquivos_renomeados, *caminhos_planilhas_imp.values()]))
+
+    # 3. Retornar um dicionário com todos os caminhos dos arquivos gerados
     return {
         "xlsx_importacao": caminhos_planilhas_imp.get("xlsx_importacao"),
         "csv_importacao": caminhos_planilhas_imp.get("csv_importacao"),
-        "txt_importacao": caminho_txt,
+        "txt_importacao": caminhos_planilhas_imp.get("txt_importacao"),
         "zip_notas": caminho_zip
-    }
\ No newline at end of file
+    }
@@ -3,30 +3,31 @@
 # app/extractor.py
 
 import os
-import io
 import re
-from typing import List, Optional
+import json
+import time
+from typing import ClassVar, Dict, List, Optional, Tuple
 
 import fitz
 import pytesseract
-import pandas as pd
-from PIL import Image
 from dotenv import load_dotenv
 import numpy as np
 import cv2
 
-from langchain_google_genai import ChatGoogleGenerativeAI
-from langchain_openai import ChatOpenAI
-from langchain_anthropic import ChatAnthropic
-from langchain_mistralai import ChatMistralAI
-from langchain_groq import ChatGroq
 from langchain_core.prompts import ChatPromptTemplate
 from langchain_core.output_parsers import PydanticOutputParser
-from pydantic import BaseModel, Field
-from langchain_community.chat_models import ChatOllama
+from pydantic import BaseModel, Field, create_model
 
 from .path_utils import resource_path
 from .config_manager import load_config
+from .concurrency import obter_limitador, executar_com_retentativa
+from .providers import obter_modelo_chat
+from .cache import obter_cache, hash_arquivo, hash_bytes, montar_chave
+from .page_store import ArmazemPaginas, texto_tem_qualidade
+from .acum_index import carregar_indice_acum
+from .layouts import extrair_por_layout, VERSAO_LAYOUTS
+from .ocr import ocr_adaptativo, ocr_imagem, nome_motor_disponivel
+from .metrics import ColetorMetricas, ativar_coletor, registrar_pagina, registrar_llm
 
 # --- AJUSTE PARA PYINSTALLER ---
 # Importa a nova função de utilidade para encontrar o caminho dos recursos
@@ -61,6 +62,9 @@ class CampoValor(BaseModel):
 
 class NotaFiscalDetalhada(BaseModel):
     # (A estrutura Pydantic completa que definimos anteriormente)
+    # Incrementar sempre que o prompt de extração mudar: invalida o cache de resultados.
+    VERSAO_PROMPT: ClassVar[int] = 1
+
     prestador_cnpj: Optional[str] = Field(None, description="CNPJ do prestador de serviços.")
     prestador_razao_social: Optional[str] = Field(None, description="Razão Social ou Nome do prestador de serviços.")
     prestador_municipio: Optional[str] = Field(None, description="Município (Cidade) do endereço do prestador.")
@@ -88,6 +92,22 @@ class NotaFiscalDetalhada(BaseModel):
     observacoes_nf: Optional[str] = Field(None, description="Qualquer texto livre nos campos 'Observações' ou 'Dados Adicionais'.")
     todos_os_campos: List[CampoValor] = Field(default_factory=list, description="Uma lista de pares chave/valor que NÃO foram mapeados para os outros campos.")
 
+    @classmethod
+    def versao_schema(cls) -> str:
+        """Identificador da versão do prompt + campos do schema, usado nas chaves do cache."""
+        schema = json.dumps(cls.model_json_schema(), sort_keys=True)
+        return f"v{cls.VERSAO_PROMPT}-{hash_bytes(schema.encode('utf-8'))[:12]}"
+
+# --- Parâmetros do OCR (fazem parte da chave do cache de texto) ---
+CONFIG_OCR = {
+    "lang": "por",
+    "psm": 6,
+    # OCR adaptativo: começa no primeiro DPI e só sobe quando a confiança fica abaixo do mínimo
+    "dpis": (200, 300),
+    "confianca_minima": 70,
+    "min_caracteres_texto_direto": 300,
+}
+
 # ==============================================================================
 # NOVA FUNÇÃO: Pré-processamento de Imagem com OpenCV para Melhorar o OCR
 # ==============================================================================
@@ -108,76 +128,113 @@ def _corrigir_inclinacao(img_cv):
     rotated = cv2.warpAffine(img_cv, M, (w, h), flags=cv2.INTER_CUBIC, borderMode=cv2.BORDER_CONSTANT, borderValue=(255,255,255))
     return rotated ()
 
-def _pre_processar_imagem_para_ocr(img: Image.Image) -> Image.Image:
+# --- Motores de Extração de Texto (Função principal alterada) ---
+def _extrair_texto_com_paginas(caminho_arquivo: str, paginas: List[int] = None, paginas_conhecidas: Optional[Dict[int, dict]] = None) -> Tuple[str, Dict[int, dict]]:
     """
-    Aplica uma série de filtros do OpenCV para limpar a imagem,
-    melhorando a precisão do Tesseract em documentos digitalizados.
+    Extrai o texto do arquivo reaproveitando o que já se sabe de cada página
+    ('paginas_conhecidas', vindas do ArmazemPaginas do lote). O OCR de alta
+    qualidade só roda nas páginas cujo texto guardado não passa na verificação
+    de qualidade. Retorna o texto e as entradas novas/atualizadas por página,
+    para que o processo principal as devolva ao armazém.
     """
-    # Converte a imagem PIL para o formato que o OpenCV usa (numpy array)
-    img_cv = np.array(img)
-    
-    # 1. Converte para escala de cinza (essencial para OCR)
-    gray = cv2.cvtColor(img_cv, cv2.COLOR_BGR2GRAY)
-    
-    # 2. Binarização: Transforma a imagem em apenas preto e branco.
-    #    O threshold adaptativo é excelente para documentos com iluminação irregular.
-    binary = cv2.adaptiveThreshold(gray, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C, 
-                                   cv2.THRESH_BINARY, 11, 2)
-    
-    # 3. Remoção de Ruído (opcional, mas bom para digitalizações de baixa qualidade)
-    denoised = cv2.medianBlur(binary, 3)
-    
-    # Converte a imagem de volta para o formato PIL para o Pytesseract
-    return Image.fromarray(denoised)
-
-# --- Motores de Extração de Texto (Função principal alterada) ---
-def _extrair_texto_localmente(caminho_arquivo: str, paginas: List[int] = None) -> str:
     print(f"Iniciando extração de texto LOCAL para: {caminho_arquivo} (Páginas: {paginas or 'Todas'})")
     texto_completo = ""
-    # Define a configuração do Tesseract que usaremos
-    tesseract_config = '--psm 6'
+    paginas_conhecidas = paginas_conhecidas or {}
+    paginas_novas = {}
 
     try:
         extensao = os.path.splitext(caminho_arquivo)[1].lower()
         if extensao == '.pdf':
             with fitz.open(caminho_arquivo) as doc:
-                paginas_a_processar = paginas if paginas else range(1, len(doc) + 1)
+                paginas_a_processar = [p for p in (paginas if paginas else range(1, len(doc) + 1)) if p <= len(doc)]
+                duracoes_texto_direto = {}
                 for num_pagina in paginas_a_processar:
-                    if num_pagina > len(doc): continue
-                    pagina = doc.load_page(num_pagina - 1)
-                    texto_completo += pagina.get_text("text", sort=True) + "\n\n"
+                    inicio = time.perf_counter()
+                    texto_direto = paginas_conhecidas.get(num_pagina, {}).get("texto_direto")
+                    if texto_direto is None:
+                        texto_direto = doc.load_page(num_pagina - 1).get_text("text", sort=True)
+                        paginas_novas[num_pagina] = {"texto_direto": texto_direto}
+                    duracoes_texto_direto[num_pagina] = (time.perf_counter() - inicio, len(texto_direto))
+                    texto_completo += texto_direto + "\n\n"
             
-            if len(texto_completo.strip()) < 300:
-                print("Texto extraído é curto. Acionando OCR forçado para PDF...")
-                texto_ocr = ""
-                with fitz.open(caminho_arquivo) as doc:
-                    paginas_a_processar = paginas if paginas else range(1, len(doc) + 1)
-                    for i, num_pagina in enumerate(paginas_a_processar):
-                        if num_pagina > len(doc): continue
+                if len(texto_completo.strip()) >= CONFIG_OCR["min_caracteres_texto_direto"]:
+                    for num_pagina, (duracao, caracteres) in duracoes_texto_direto.items():
+                        registrar_pagina("extrator", caminho_arquivo, num_pagina, "texto_direto", duracao, caracteres=caracteres)
+                else:
+                    print("Texto extraído é curto. Acionando OCR forçado para PDF...")
+                    texto_ocr = ""
+                    for num_pagina in paginas_a_processar:
+                        conhecida = paginas_conhecidas.get(num_pagina, {})
+                        texto_ocr_guardado = conhecida.get("texto_ocr")
+                        # O OCR adaptativo recomeça acima do DPI já tentado na segmentação
+                        dpis = CONFIG_OCR["dpis"]
+                        if texto_ocr_guardado is not None:
+                            dpis = [dpi for dpi in dpis if dpi > (conhecida.get("dpi_ocr") or 0)]
+                        if texto_ocr_guardado is not None and (texto_tem_qualidade(texto_ocr_guardado) or not dpis):
+                            print(f"  - Página {num_pagina}: reaproveitando OCR feito na segmentação ({conhecida.get('dpi_ocr')} DPI).")
+                            texto_ocr += texto_ocr_guardado + "\n\n"
+                            registrar_pagina("extrator", caminho_arquivo, num_pagina, "ocr_reaproveitado", dpi=conhecida.get("dpi_ocr"), caracteres=len(texto_ocr_guardado))
+                            continue
                         print(f"  - Processando página {num_pagina} com OCR aprimorado...")
+                        inicio = time.perf_counter()
                         pagina = doc.load_page(num_pagina - 1)
-                        pix = pagina.get_pixmap(dpi=300)
-                        img_pil = Image.open(io.BytesIO(pix.tobytes()))
-                        img_processada = _pre_processar_imagem_para_ocr(img_pil)
-                        
-                        # --- CORREÇÃO APLICADA AQUI ---
-                        texto_ocr += pytesseract.image_to_string(img_processada, lang='por', config=tesseract_config) + "\n\n"
-                texto_completo = texto_ocr
+                        texto_pagina, dpi_usado = ocr_adaptativo(pagina, dpis, CONFIG_OCR["confianca_minima"], lang=CONFIG_OCR["lang"], psm=CONFIG_OCR["psm"])
+                        registrar_pagina("extrator", caminho_arquivo, num_pagina, "ocr", time.perf_counter() - inicio, dpi=dpi_usado, caracteres=len(texto_pagina))
+                        paginas_novas.setdefault(num_pagina, {}).update({"texto_ocr": texto_pagina, "dpi_ocr": dpi_usado})
+                        texto_ocr += texto_pagina + "\n\n"
+                    texto_completo = texto_ocr
 
         elif extensao in ['.png', '.jpg', '.jpeg', '.tiff', '.bmp']:
             print("Processando arquivo de imagem com OCR aprimorado...")
-            img_pil = Image.open(caminho_arquivo)
-            img_processada = _pre_processar_imagem_para_ocr(img_pil)
-            
-            # --- CORREÇÃO APLICADA AQUI ---
-            texto_completo = pytesseract.image_to_string(img_processada, lang='por', config=tesseract_config)
+            inicio = time.perf_counter()
+            texto_completo = ocr_imagem(caminho_arquivo, lang=CONFIG_OCR["lang"], psm=CONFIG_OCR["psm"])
+            registrar_pagina("extrator", caminho_arquivo, 1, "ocr_imagem", time.perf_counter() - inicio, caracteres=len(texto_completo))
 
-        return texto_completo.strip()
+        return texto_completo.strip(), paginas_novas
     except Exception as e:
         print(f"Erro na extração local: {e}")
-        return f"ERRO_NA_EXTRACAO_LOCAL: {e}"
+        return f"ERRO_NA_EXTRACAO_LOCAL: {e}", paginas_novas
+
+def _extrair_texto_com_metricas(caminho_arquivo: str, paginas: List[int] = None, paginas_conhecidas: Optional[Dict[int, dict]] = None) -> Tuple[str, Dict[int, dict], list]:
+    """
+    Versão para o pool de processos: as métricas de página ficam em um coletor
+    local da tarefa e voltam ao processo principal junto com o texto.
+    """
+    coletor = ativar_coletor(ColetorMetricas())
+    texto_completo, paginas_novas = _extrair_texto_com_paginas(caminho_arquivo, paginas, paginas_conhecidas)
+    return texto_completo, paginas_novas, coletor.paginas
 
 
+# ==============================================================================
+# CACHE DE TEXTO BRUTO
+# ==============================================================================
+def chave_cache_texto(caminho_arquivo: str, paginas: Optional[List[int]] = None) -> str:
+    """Chave do texto bruto: conteúdo do arquivo + páginas + parâmetros do OCR."""
+    # O motor entra na chave pelo que realmente iniciou, não pelo que pode ser importado
+    parametros_ocr = {**CONFIG_OCR, "motor": nome_motor_disponivel(CONFIG_OCR["lang"], CONFIG_OCR["psm"])}
+    return montar_chave("texto", hash_arquivo(caminho_arquivo), list(paginas) if paginas else None, parametros_ocr)
+
+def obter_texto_bruto(caminho_arquivo: str, paginas: Optional[List[int]] = None, config: Optional[dict] = None, armazem: Optional[ArmazemPaginas] = None) -> str:
+    """
+    Retorna o texto bruto do cache ou o extrai localmente (e o guarda no cache).
+    Com um 'armazem', reaproveita o texto/OCR por página já obtido no lote.
+    """
+    cache = obter_cache(config or load_config())
+    chave = chave_cache_texto(caminho_arquivo, paginas) if cache.habilitado else None
+    if chave:
+        texto_em_cache = cache.obter_texto(chave)
+        if texto_em_cache is not None:
+            print(f"Texto de '{os.path.basename(caminho_arquivo)}' (Páginas: {paginas or 'Todas'}) recuperado do cache.")
+            return texto_em_cache
+
+    paginas_conhecidas = armazem.paginas_do_arquivo(caminho_arquivo, paginas) if armazem else None
+    texto_bruto, paginas_novas = _extrair_texto_com_paginas(caminho_arquivo, paginas, paginas_conhecidas)
+    if armazem:
+        armazem.mesclar(caminho_arquivo, paginas_novas)
+    if chave and texto_bruto and not texto_bruto.startswith("ERRO"):
+        cache.salvar_texto(chave, texto_bruto)
+    return texto_bruto
+
 def enriquecer_dados_acum(dados_extraidos: dict, caminho_planilha_map: str) -> dict:
     if not caminho_planilha_map or not os.path.exists(caminho_planilha_map):
         return dados_extraidos
@@ -185,87 +242,23 @@ def enriquecer_dados_acum(dados_extraidos: dict, caminho_planilha_map: str) -> d
     if not codigo_servico_nf:
         return dados_extraidos
     try:
-        print(f"Enriquecendo dados com a planilha: {caminho_planilha_map}")
-        df_map = pd.read_excel(caminho_planilha_map, dtype={'Referência': str})
-        df_map.columns = df_map.columns.str.strip()
-        if 'Referência' not in df_map.columns or 'ACUMULADOR TOMADOS' not in df_map.columns:
-            print(f"AVISO: A planilha de mapeamento não contém as colunas 'Referência' e 'ACUMULADOR TOMADOS'.")
-            return dados_extraidos
-        codigo_servico_nf_str = str(codigo_servico_nf).strip()
-        resultado = pd.DataFrame()
-        if not codigo_servico_nf_str.isspace() and codigo_servico_nf_str:
-             resultado = df_map.loc[df_map['Referência'].str.strip() == codigo_servico_nf_str]
-        if resultado.empty:
-            df_map['Referencia_Normalizada'] = df_map['Referência'].astype(str).str.replace(r'\D', '', regex=True)
-            codigo_servico_normalizado = re.sub(r'\D', '', codigo_servico_nf_str)
-            if codigo_servico_normalizado:
-                resultado = df_map.loc[df_map['Referencia_Normalizada'] == codigo_servico_normalizado]
-        if not resultado.empty:
-            valor_acum = resultado['ACUMULADOR TOMADOS'].iloc[0]
-            if pd.isna(valor_acum):
-                dados_extraidos['acum'] = ""
-                print(f"AVISO: Código '{codigo_servico_nf}' encontrado, mas o valor 'ACUM' está vazio.")
+        # O índice é compilado uma única vez e reaproveitado por todas as notas
+        indice = carregar_indice_acum(caminho_planilha_map)
+        valor_acum = indice.buscar(codigo_servico_nf) if indice else None
+        if valor_acum is not None:
+            dados_extraidos['acum'] = valor_acum
+            if valor_acum:
+                print(f"Campo 'acum' preenchido com '{valor_acum}' para o código '{codigo_servico_nf}'.")
             else:
-                dados_extraidos['acum'] = str(int(valor_acum))
-                print(f"Campo 'acum' preenchido com '{dados_extraidos['acum']}' para o código '{codigo_servico_nf}'.")
+                print(f"AVISO: Código '{codigo_servico_nf}' encontrado, mas o valor 'ACUM' está vazio.")
     except Exception as e:
         print(f"AVISO: Não foi possível processar a planilha de mapeamento 'Acum'. Erro: {e}")
     return dados_extraidos
 
-def agente_extrator(caminho_arquivo: str, paginas: Optional[List[int]] = None) -> dict:
-    """Orquestra o processo de extração e estruturação de dados de um arquivo."""
-    load_dotenv(override=True)
-    print("--- Agente Extrator Acionado ---")
-    config = load_config()
-    provider = config.get("provider")
-    model_name_config = config.get("custom_model", "").strip() or config.get("model")
-
-    texto_bruto = _extrair_texto_localmente(caminho_arquivo, paginas=paginas)
-
-    if not texto_bruto or texto_bruto.startswith("ERRO"):
-        return {"erro": "Falha na etapa de extração de texto.", "detalhes": texto_bruto}
-
-    # ==============================================================================
-    # PONTO DE DEBUG: Imprime o texto bruto enviado ao LLM
-    # ==============================================================================
-    print("\n" + "="*50)
-    print(f"TEXTO BRUTO EXTRAÍDO DE '{os.path.basename(caminho_arquivo)}' (ENVIADO AO LLM):")
-    print("="*50)
-    print(texto_bruto)
-    print("="*50 + "\n")
-    # ==============================================================================
-
-    print(f"Extração de texto concluída. Estruturando com: {provider}/{model_name_config}")
-    try:
-        model = None
-        if provider == 'google':
-            api_key = os.getenv("GOOGLE_API_KEY")
-            if not api_key:
-                raise ValueError("A chave de API do Google (GOOGLE_API_KEY) não foi encontrada.")
-            # --- LÓGICA ALTERADA ---
-            model = ChatGoogleGenerativeAI(
-                model=model_name_config, 
-                google_api_key=api_key,
-                temperature=0.0)
-        elif provider == 'openai':
-            model = ChatOpenAI(model_name=model_name_config, temperature=0.0, api_key=os.getenv("OPENAI_API_KEY"))
-        elif provider == 'anthropic':
-            model = ChatAnthropic(model_name=model_name_config, temperature=0.0, api_key=os.getenv("ANTHROPIC_API_KEY"))
-        elif provider == 'mistral':
-            model = ChatMistralAI(model_name=model_name_config, temperature=0.0, api_key=os.getenv("MISTRAL_API_KEY"))
-        elif provider == 'groq':
-            model = ChatGroq(model_name=model_name_config, temperature=0.0, api_key=os.getenv("GROQ_API_KEY"))
-        elif provider == 'ollama':
-            base_url = os.getenv("OLLAMA_BASE_URL")
-            if not base_url:
-                raise ValueError("A variável OLLAMA_BASE_URL não está definida.")
-            model = ChatOllama(model=model_name_config, base_url=base_url, temperature=0.0)
-        
-        if not model:
-            raise ValueError(f"Provedor '{provider}' não suportado.")
-
-        parser = PydanticOutputParser(pydantic_object=NotaFiscalDetalhada)
-        prompt_template = ChatPromptTemplate.from_messages([
+# ==============================================================================
+# PROMPT DE ESTRUTURAÇÃO (montado uma única vez, compartilhado entre as threads)
+# ==============================================================================
+PROMPT_EXTRACAO = ChatPromptTemplate.from_messages([
             ("system", """Você é um sistema de Processamento Inteligente de Documentos (IDP) ultrapreciso, focado em extrair dados de UMA ÚNICA NOTA FISCAL de serviço do Brasil por vez. Sua única função é analisar o texto, que pode ser ruidoso e vir de um OCR, e preencher a estrutura JSON com exatidão.
 
 REGRAS DE OURO:
@@ -405,23 +398,154 @@ INSS (RS): Pis/Pasep (R$): Outros (R$): 1.233,38
 """),
     ("human", "Agora, analise e estruture o seguinte texto extraído de uma nota fiscal:\n\n---\n{texto_documento}\n---")
 ])
-        chain = prompt_template | model | parser
-        resultado = chain.invoke({"texto_documento": texto_bruto, "format_instructions": parser.get_format_instructions()})
-        resultado_dict = resultado.dict()
-
-        if resultado_dict.get("codigo_servico"):
-            codigo_servico_bruto = str(resultado_dict["codigo_servico"])
-            codigo_numerico = re.sub(r'\D', '', codigo_servico_bruto)
-            codigo_limpo = str(int(codigo_numerico)) if codigo_numerico else ""
-            resultado_dict["codigo_servico"] = codigo_limpo
-            print(f"Código de serviço normalizado para: '{codigo_limpo}'")
-
-        print("Estruturação com IA concluída com sucesso.")
+
+# --- Prompt enxuto: usado quando um layout conhecido já preencheu a maior parte da nota ---
+PROMPT_EXTRACAO_PARCIAL = ChatPromptTemplate.from_messages([
+    ("system", """Você é um sistema de Processamento Inteligente de Documentos (IDP) ultrapreciso. Parte desta nota fiscal de serviço do Brasil já foi lida automaticamente; extraia APENAS os campos pedidos no schema abaixo.
+
+REGRAS:
+1.  **EXTRAÇÃO LITERAL**: Extraia os valores exatamente como aparecem, sem calcular ou formatar.
+2.  **SEJA RESILIENTE AO OCR**: O texto pode estar mal formatado. Conecte cada etiqueta ao seu valor, mesmo que estejam em linhas diferentes.
+3.  **CAMPOS AUSENTES**: Se um campo não for encontrado no texto, o valor DEVE ser `null`.
+
+{format_instructions}
+"""),
+    ("human", "Texto da nota fiscal:\n\n---\n{texto_documento}\n---")
+])
+
+def _normalizar_codigo_servico(resultado_dict: dict) -> dict:
+    if resultado_dict.get("codigo_servico"):
+        codigo_servico_bruto = str(resultado_dict["codigo_servico"])
+        codigo_numerico = re.sub(r'\D', '', codigo_servico_bruto)
+        codigo_limpo = str(int(codigo_numerico)) if codigo_numerico else ""
+        resultado_dict["codigo_servico"] = codigo_limpo
+        print(f"Código de serviço normalizado para: '{codigo_limpo}'")
+    return resultado_dict
+
+def _modelo_parcial(campos: List[str]):
+    """Schema Pydantic contendo apenas os campos pedidos (mesmas descrições do schema completo)."""
+    definicoes = {campo: (Optional[str], NotaFiscalDetalhada.model_fields[campo]) for campo in campos}
+    return create_model("NotaFiscalParcial", **definicoes)
+
+def _invocar_llm(prompt: ChatPromptTemplate, schema, texto_bruto: str, config: dict):
+    """Executa prompt -> modelo -> parser respeitando os limites do provedor e com retentativas."""
+    provider = config.get("provider")
+    model_name_config = config.get("custom_model", "").strip() or config.get("model")
+    model = obter_modelo_chat(provider, model_name_config)
+    parser = PydanticOutputParser(pydantic_object=schema)
+    # O parser roda à parte: a resposta bruta (com 'usage_metadata') fica disponível às
+    # métricas e só a chamada ao provedor é repetida, dentro do limitador.
+    chain = prompt | model
+    limitador = obter_limitador(provider, config)
+    tentativas = []
+
+    def _chamar_llm():
+        tentativas.append(1)
+        with limitador:
+            return chain.invoke({"texto_documento": texto_bruto, "format_instructions": parser.get_format_instructions()})
+
+    inicio = time.perf_counter()
+    tipo_prompt = "completo" if schema is NotaFiscalDetalhada else "parcial"
+    try:
+        resposta = executar_com_retentativa(
+            _chamar_llm,
+            max_tentativas=int(config.get("llm_max_tentativas") or 1),
+            backoff_inicial=float(config.get("llm_backoff_inicial") or 1.0),
+            descricao=f"Chamada ao provedor '{provider}'"
+        )
+    except Exception:
+        registrar_llm(provider, model_name_config, time.perf_counter() - inicio, len(tentativas), False, prompt=tipo_prompt)
+        raise
+    uso = getattr(resposta, "usage_metadata", None) or {}
+    registrar_llm(provider, model_name_config, time.perf_counter() - inicio, len(tentativas), True,
+                  tokens_entrada=uso.get("input_tokens", 0), tokens_saida=uso.get("output_tokens", 0), prompt=tipo_prompt)
+    # Uma resposta fora do schema falha aqui, uma única vez, sem nova cobrança do provedor
+    return parser.invoke(resposta)
+
+def estruturar_texto_com_ia(texto_bruto: str, config: Optional[dict] = None) -> dict:
+    """
+    Estrutura o texto já extraído. Layouts conhecidos são lidos por regras
+    (app/layouts.py) e só os campos ausentes/reprovados vão ao LLM, com um prompt
+    enxuto; os demais textos usam o prompt completo. Respeita os limites de
+    concorrência/RPM do provedor e repete a chamada em respostas 429/5xx.
+    Pode ser chamada de várias threads ao mesmo tempo.
+    """
+    config = config or load_config()
+    provider = config.get("provider")
+    model_name_config = config.get("custom_model", "").strip() or config.get("model")
+    usar_layouts = config.get("layouts_habilitados", True)
+
+    cache = obter_cache(config)
+    chave_resultado = montar_chave(
+        "resultado", hash_bytes(texto_bruto.encode('utf-8')), provider, model_name_config,
+        NotaFiscalDetalhada.versao_schema(), VERSAO_LAYOUTS if usar_layouts else None
+    )
+    resultado_em_cache = cache.obter_resultado(chave_resultado)
+    if resultado_em_cache is not None:
+        print(f"Resultado estruturado recuperado do cache ({provider}/{model_name_config}).")
+        return resultado_em_cache
+
+    try:
+        resultado_completo = True
+        resultado_layout = extrair_por_layout(texto_bruto) if usar_layouts else None
+        if resultado_layout:
+            nome_layout, dados_layout, pendentes = resultado_layout
+            resultado_dict = NotaFiscalDetalhada(**dados_layout).dict()
+            if pendentes:
+                print(f"Layout '{nome_layout}' reconhecido. Consultando {provider}/{model_name_config} apenas para: {', '.join(pendentes)}")
+                try:
+                    parcial = _invocar_llm(PROMPT_EXTRACAO_PARCIAL, _modelo_parcial(pendentes), texto_bruto, config)
+                    resultado_dict.update(parcial.dict())
+                except Exception as e:
+                    # Os campos lidos pelo layout continuam valendo; os pendentes ficam vazios
+                    # para a validação manual. O resultado incompleto não vai para o cache.
+                    print(f"Erro na consulta parcial à IA ({e}). Mantendo os campos do layout '{nome_layout}'.")
+                    resultado_completo = False
+            else:
+                print(f"Layout '{nome_layout}' reconhecido. Todos os campos validados sem chamada à IA.")
+        else:
+            print(f"Extração de texto concluída. Estruturando com: {provider}/{model_name_config}")
+            resultado_dict = _invocar_llm(PROMPT_EXTRACAO, NotaFiscalDetalhada, texto_bruto, config).dict()
+
+        _normalizar_codigo_servico(resultado_dict)
+        if resultado_completo:
+            print("Estruturação com IA concluída com sucesso.")
+            cache.salvar_resultado(chave_resultado, resultado_dict)
         return resultado_dict
     except Exception as e:
         print(f"Erro durante a chamada da IA de estruturação: {e}")
         return {"erro": f"Falha na comunicação com a API de IA: {e}"}
 
+def agente_extrator(caminho_arquivo: str, paginas: Optional[List[int]] = None, config: Optional[dict] = None) -> dict:
+    """
+    Orquestra o processo de extração e estruturação de dados de um arquivo.
+    Quem processa várias notas deve carregar a configuração uma vez e passá-la em 'config'.
+    """
+    print("--- Agente Extrator Acionado ---")
+    if config is None:
+        load_dotenv(override=True)
+        config = load_config()
+
+    texto_bruto = obter_texto_bruto(caminho_arquivo, paginas=paginas, config=config)
+    return estruturar_texto_extraido(caminho_arquivo, texto_bruto, config)
+
+def estruturar_texto_extraido(caminho_arquivo: str, texto_bruto: str, config: Optional[dict] = None) -> dict:
+    """Valida o texto bruto de uma nota e o encaminha para a estruturação com IA."""
+    if not texto_bruto or texto_bruto.startswith("ERRO"):
+        return {"erro": "Falha na etapa de extração de texto.", "detalhes": texto_bruto}
+
+    # ==============================================================================
+    # PONTO DE DEBUG: Imprime o texto bruto enviado ao LLM
+    # ==============================================================================
+    print("\n" + "="*50)
+    print(f"TEXTO BRUTO EXTRAÍDO DE '{os.path.basename(caminho_arquivo)}' (ENVIADO AO LLM):")
+    print("="*50)
+    print(texto_bruto)
+    print("="*50 + "\n")
+    # ==============================================================================
+
+    return estruturar_texto_com_ia(texto_bruto, config)
+
 # --- Bloco de teste ---
 if __name__ == '__main__':
     arquivo_para_teste = "caminho/para/seu/arquivo_de_teste.pdf"
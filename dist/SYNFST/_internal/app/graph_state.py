@@ -1,6 +1,6 @@
 # app/graph_state.py
 
-from typing import List, Dict, TypedDict, Optional
+from typing import Any, List, Dict, TypedDict, Optional
 
 # ==============================================================================
 # DEFINIÇÃO DO ESTADO DO GRAFO
@@ -33,6 +33,16 @@ class LoteState(TypedDict):
     # Um dicionário para armazenar os resultados da extração da IA para cada nota.
     # A chave será o ID interno da nota (ex: 'NF_01') e o valor será o JSON extraído.
     resultados_extracao: Dict[str, Dict]
+
+    # --- Cache de Páginas do Lote ---
+    # ArmazemPaginas (app/page_store.py) com o texto direto e o OCR de cada página.
+    # Preenchido pelo segmentador e reaproveitado pelo extrator. Criado sob demanda.
+    armazem_paginas: Optional[Any]
+
+    # --- Métricas do Lote ---
+    # ColetorMetricas (app/metrics.py) com tempos por nó, decisões de OCR por página,
+    # chamadas ao LLM e bytes de E/S. Criado pelo primeiro nó do grafo.
+    metricas: Optional[Any]
     
     # --- Controle de Fluxo e Erros (Guardrails) ---
     # Uma mensagem de status geral que pode ser atualizada por cada agente.
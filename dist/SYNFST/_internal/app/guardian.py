@@ -1,102 +1,309 @@
 # app/guardian.py
 import os
+import io
+import hashlib
+import tempfile
 import zipfile
 import rarfile
 import shutil
+from typing import Optional
 
 # --- AJUSTE PARA PYINSTALLER ---
 # Importa a função de utilidade para encontrar o caminho dos recursos
 from .path_utils import resource_path
+from .metrics import registrar_io
+from .config_manager import load_config
+from .cache import registrar_hash_arquivo
 # Adiciona o caminho do executável UnRAR ao PATH para que 'rarfile' o encontre.
 os.environ["PATH"] += os.pathsep + resource_path('bin')
 
-# --- MELHORIA 1: Expandida a lista de extensões válidas ---
-EXTENSOES_VALIDAS = ['.pdf', '.png', '.jpg', '.jpeg', '.tiff', '.bmp']
+# ==============================================================================
+# ENTRADA DO LOTE: TIPO PELO CONTEÚDO, ARQUIVOS COMPACTADOS EM STREAMING E
+# DEDUPLICAÇÃO POR HASH
+# ==============================================================================
+# - O tipo de cada arquivo é identificado pelos primeiros bytes ("magic bytes");
+#   a extensão informada pelo cliente não é usada.
+# - Arquivos .zip/.rar (inclusive aninhados) são percorridos membro a membro:
+#   só as notas aceitas são gravadas no lote, e o SHA-256 é calculado enquanto
+#   cada uma é copiada.
+# - Notas com o mesmo conteúdo viram uma única unidade, com todos os nomes de
+#   origem em 'nomes_origem' (sem OCR/LLM repetidos para duplicatas).
+# - Limites de tamanho, quantidade de membros, profundidade e taxa de
+#   compressão (zip-bomb) são verificados e as violações são relatadas.
+# ==============================================================================
 
-def _descompactar_zip(caminho_completo_zip, caminho_lote):
-    """Função auxiliar para descompactar arquivos .zip de forma segura."""
-    try:
-        with zipfile.ZipFile(caminho_completo_zip, 'r') as zip_ref:
-            zip_ref.extractall(caminho_lote)
-        os.remove(caminho_completo_zip)
-        print(f"Arquivo '{os.path.basename(caminho_completo_zip)}' descompactado com sucesso.")
-        return True
-    except Exception as e:
-        print(f"Erro ao descompactar '{os.path.basename(caminho_completo_zip)}': {e}")
-        return False
+# --- MELHORIA 1: Expandida a lista de formatos válidos (agora por conteúdo) ---
+# (assinatura, tipo, extensão padronizada)
+ASSINATURAS = [
+    (b"%PDF-", "pdf", ".pdf"),
+    (b"\x89PNG\r\n\x1a\n", "imagem", ".png"),
+    (b"\xff\xd8\xff", "imagem", ".jpg"),
+    (b"II*\x00", "imagem", ".tiff"),
+    (b"MM\x00*", "imagem", ".tiff"),
+    (b"BM", "imagem", ".bmp"),
+    (b"PK\x03\x04", "zip", ".zip"),
+    (b"PK\x05\x06", "zip", ".zip"),
+    (b"Rar!\x1a\x07", "rar", ".rar"),
+]
+TIPOS_ACEITOS = ("pdf", "imagem")
+TIPOS_COMPACTADOS = ("zip", "rar")
+TAMANHO_CABECALHO = 1024
 
-# --- NOVA FUNÇÃO: Suporte para arquivos .rar ---
-def _descompactar_rar(caminho_completo_rar, caminho_lote):
-    """Função auxiliar para descompactar arquivos .rar de forma segura."""
-    try:
-        with rarfile.RarFile(caminho_completo_rar, 'r') as rar_ref:
-            rar_ref.extractall(caminho_lote)
-        os.remove(caminho_completo_rar)
-        print(f"Arquivo '{os.path.basename(caminho_completo_rar)}' descompactado com sucesso.")
-        return True
-    except rarfile.BadRarFile:
-        print(f"Erro: Arquivo '{os.path.basename(caminho_completo_rar)}' não é um RAR válido ou está corrompido.")
+TAMANHO_BLOCO = 1024 * 1024
+# Compactados aninhados ficam em memória até este tamanho; acima disso vão para disco
+LIMITE_MEMORIA_ANINHADO = 32 * 1024 * 1024
+# A taxa de compressão só é verificada em membros maiores que isto (arquivos pequenos comprimem muito)
+TAMANHO_MINIMO_VERIFICAR_TAXA = 1024 * 1024
+
+# Tamanhos válidos do cabeçalho DIB de um BMP (BITMAPCOREHEADER até BITMAPV5HEADER)
+TAMANHOS_CABECALHO_DIB = (12, 40, 52, 56, 64, 108, 124)
+
+def _cabecalho_bmp_valido(cabecalho: bytes, tamanho: Optional[int]) -> bool:
+    # 'BM' sozinho é comum demais: confere o tamanho declarado e o cabeçalho DIB
+    if len(cabecalho) < 18:
         return False
-    except Exception as e:
-        print(f"Erro inesperado ao descompactar '{os.path.basename(caminho_completo_rar)}': {e}")
+    tamanho_declarado = int.from_bytes(cabecalho[2:6], "little")
+    inicio_pixels = int.from_bytes(cabecalho[10:14], "little")
+    tamanho_dib = int.from_bytes(cabecalho[14:18], "little")
+    if tamanho_dib not in TAMANHOS_CABECALHO_DIB or inicio_pixels < 14 + tamanho_dib:
         return False
+    return tamanho is None or tamanho_declarado == tamanho
 
-def agente_guardiao(caminho_lote: str) -> dict:
+def identificar_tipo(cabecalho: bytes, tamanho: Optional[int] = None):
     """
-    Processa todos os arquivos em um diretório de lote para validação, descompressão e padronização.
-    Agora com suporte a .rar e mais formatos de imagem.
+    Retorna (tipo, extensão) a partir dos primeiros bytes, ou (None, None) se o formato
+    não for reconhecido. 'tamanho' (do arquivo inteiro) é conferido no cabeçalho do BMP.
     """
-    caminho_quarentena = os.path.join(caminho_lote, "quarentena")
-    os.makedirs(caminho_quarentena, exist_ok=True)
-    
-    # --- MELHORIA 2: Lógica de descompressão primeiro ---
-    # Garante que todos os arquivos sejam extraídos antes da validação.
-    houve_descompressao = True
-    while houve_descompressao:
-        houve_descompressao = False
-        arquivos_no_lote = os.listdir(caminho_lote)
-        for nome_arquivo in arquivos_no_lote:
-            caminho_completo = os.path.join(caminho_lote, nome_arquivo)
-            if not os.path.isfile(caminho_completo):
+    for assinatura, tipo, extensao in ASSINATURAS:
+        if cabecalho.startswith(assinatura):
+            if extensao == ".bmp" and not _cabecalho_bmp_valido(cabecalho, tamanho):
                 continue
+            return tipo, extensao
+    # A especificação do PDF permite lixo antes do '%PDF-' dentro do primeiro 1 KB
+    if b"%PDF-" in cabecalho[:TAMANHO_CABECALHO]:
+        return "pdf", ".pdf"
+    return None, None
 
-            if nome_arquivo.lower().endswith('.zip'):
-                if _descompactar_zip(caminho_completo, caminho_lote):
-                    houve_descompressao = True
-            elif nome_arquivo.lower().endswith('.rar'):
-                if _descompactar_rar(caminho_completo, caminho_lote):
-                    houve_descompressao = True
-    
-    # Segunda passagem: Validar e renomear todos os arquivos após descompressão
-    arquivos_validados = []
-    arquivos_em_quarentena = []
-    contador_validos = 1
-
-    for nome_arquivo in os.listdir(caminho_lote):
-        caminho_original_completo = os.path.join(caminho_lote, nome_arquivo)
-        if not os.path.isfile(caminho_original_completo):
-            continue
+class _EntradaDoLote:
+    """Estado da leitura de um lote: limites, contadores, unidades aceitas e violações."""
+
+    def __init__(self, caminho_lote: str, limites: dict):
+        self.caminho_lote = caminho_lote
+        self.caminho_quarentena = os.path.join(caminho_lote, "quarentena")
+        self.tamanho_total_max = int(limites.get("tamanho_total_max_mb", 2048)) * 1024 * 1024
+        self.tamanho_membro_max = int(limites.get("tamanho_membro_max_mb", 200)) * 1024 * 1024
+        self.membros_max = int(limites.get("membros_max", 5000))
+        self.profundidade_max = int(limites.get("profundidade_max", 3))
+        self.taxa_compressao_max = float(limites.get("taxa_compressao_max", 100))
+
+        self.unidades_por_hash = {}
+        self.validados = []
+        self.quarentena = []
+        self.violacoes = []
+        self.duplicados = 0
+        self.membros_lidos = 0
+        self.bytes_aceitos = 0
+        self.bytes_lidos = 0
+        self.bytes_gravados = 0
+        self._contador_temporario = 0
+        self._numero_nota = 0
+
+    # --- Registro das unidades ---
+
+    def _registrar_unidade(self, caminho_temporario: str, extensao: str, sha256: str, nome_original: str, nome_origem: str, tamanho: int):
+        existente = self.unidades_por_hash.get(sha256)
+        if existente:
+            os.remove(caminho_temporario)
+            existente["nomes_origem"].append(nome_origem)
+            self.duplicados += 1
+            print(f"Duplicata ignorada: '{nome_origem}' tem o mesmo conteúdo de '{existente['nomes_origem'][0]}'.")
+            return
+        novo_nome = self._proximo_nome_livre(extensao)
+        novo_caminho_completo = os.path.join(self.caminho_lote, novo_nome)
+        os.rename(caminho_temporario, novo_caminho_completo)
+        # O cache de extração reaproveita o hash em vez de reler o arquivo
+        registrar_hash_arquivo(novo_caminho_completo, sha256)
+        unidade = {
+            "nome_original": nome_original,
+            "nome_padronizado": novo_nome,
+            "caminho": novo_caminho_completo,
+            "sha256": sha256,
+            "nomes_origem": [nome_origem],
+            "tamanho": tamanho,
+        }
+        self.unidades_por_hash[sha256] = unidade
+        self.validados.append(unidade)
+
+    def _proximo_nome_livre(self, extensao: str) -> str:
+        # A pasta do lote ainda tem envios não processados: um envio que já se chame
+        # 'nota_original_NNN' não pode ser sobrescrito (nem travar o os.rename no Windows)
+        while True:
+            self._numero_nota += 1
+            nome = f"nota_original_{self._numero_nota:03d}{extensao}"
+            if not os.path.exists(os.path.join(self.caminho_lote, nome)):
+                return nome
+
+    def _violacao(self, mensagem: str):
+        print(f"AVISO (guardião): {mensagem}")
+        self.violacoes.append(mensagem)
+
+    def _mover_para_quarentena(self, caminho: str, nome: str):
+        os.makedirs(self.caminho_quarentena, exist_ok=True)
+        shutil.move(caminho, os.path.join(self.caminho_quarentena, nome))
+        self.quarentena.append(nome)
+
+    # --- Leitura ---
+
+    def _copiar_com_hash(self, origem, destino, limite: int, nome_origem: str):
+        """Copia o stream em blocos calculando o SHA-256. Retorna (sha256, bytes) ou None se passar do limite."""
+        sha = hashlib.sha256()
+        total = 0
+        for bloco in iter(lambda: origem.read(TAMANHO_BLOCO), b''):
+            total += len(bloco)
+            if total > limite:
+                self._violacao(f"'{nome_origem}' excede o tamanho máximo permitido ao ser descompactado. Ignorado.")
+                return None
+            sha.update(bloco)
+            destino.write(bloco)
+        return sha.hexdigest(), total
+
+    def processar_arquivo_enviado(self, caminho: str, nome_arquivo: str):
+        """Trata um arquivo enviado diretamente para o lote (nível superior)."""
+        tamanho = os.path.getsize(caminho)
+        with open(caminho, 'rb') as f:
+            tipo, extensao = identificar_tipo(f.read(TAMANHO_CABECALHO), tamanho)
+
+        if tipo in TIPOS_ACEITOS:
+            sha = hashlib.sha256()
+            with open(caminho, 'rb') as f:
+                for bloco in iter(lambda: f.read(TAMANHO_BLOCO), b''):
+                    sha.update(bloco)
+            self.bytes_lidos += tamanho
+            self.bytes_aceitos += tamanho
+            self._registrar_unidade(caminho, extensao, sha.hexdigest(), nome_arquivo, nome_arquivo, tamanho)
+        elif tipo in TIPOS_COMPACTADOS:
+            self.bytes_lidos += tamanho
+            try:
+                self._percorrer_compactado(caminho, tipo, nome_arquivo, profundidade=1)
+                os.remove(caminho)
+                print(f"Arquivo '{nome_arquivo}' descompactado com sucesso.")
+            except (zipfile.BadZipFile, rarfile.Error) as e:
+                self._violacao(f"'{nome_arquivo}' não é um arquivo compactado válido ou está corrompido: {e}")
+                self._mover_para_quarentena(caminho, nome_arquivo)
+        else:
+            self._mover_para_quarentena(caminho, nome_arquivo)
+
+    def _percorrer_compactado(self, arquivo, tipo: str, nome_origem: str, profundidade: int):
+        """Percorre os membros de um .zip/.rar ('arquivo' é um caminho ou stream com seek)."""
+        classe = zipfile.ZipFile if tipo == "zip" else rarfile.RarFile
+        with classe(arquivo, 'r') as compactado:
+            for info in compactado.infolist():
+                if info.is_dir():
+                    continue
+                nome_membro = f"{nome_origem}/{info.filename}"
+                self.membros_lidos += 1
+                if self.membros_lidos > self.membros_max:
+                    self._violacao(f"Limite de {self.membros_max} arquivos por lote atingido em '{nome_origem}'. Os demais membros foram ignorados.")
+                    return
+                if info.file_size > self.tamanho_membro_max:
+                    self._violacao(f"'{nome_membro}' declara {info.file_size} bytes, acima do limite por arquivo. Ignorado.")
+                    continue
+                if info.file_size >= TAMANHO_MINIMO_VERIFICAR_TAXA and info.compress_size and info.file_size / info.compress_size > self.taxa_compressao_max:
+                    self._violacao(f"'{nome_membro}' tem taxa de compressão suspeita ({info.file_size / info.compress_size:.0f}:1, possível zip-bomb). Ignorado.")
+                    continue
+                if self.bytes_aceitos + info.file_size > self.tamanho_total_max:
+                    self._violacao(f"Tamanho total descompactado do lote passaria do limite em '{nome_membro}'. Os demais membros foram ignorados.")
+                    return
+                try:
+                    with compactado.open(info) as membro:
+                        self._processar_membro(membro, info, nome_membro, profundidade)
+                except (zipfile.BadZipFile, rarfile.Error, RuntimeError, NotImplementedError) as e:
+                    # Ex: membro protegido por senha, método de compressão não suportado ou CRC inválido
+                    self._violacao(f"Não foi possível ler '{nome_membro}': {e}")
+
+    def _processar_membro(self, membro, info, nome_membro: str, profundidade: int):
+        cabecalho = membro.read(TAMANHO_CABECALHO)
+        tipo, extensao = identificar_tipo(cabecalho, info.file_size)
+        # O cabeçalho já lido volta para a frente do stream
+        fluxo = io.BufferedReader(_StreamComPrefixo(cabecalho, membro))
+        limite = min(self.tamanho_membro_max, self.tamanho_total_max - self.bytes_aceitos)
 
-        nome_base, extensao = os.path.splitext(nome_arquivo)
-        extensao = extensao.lower()
-
-        if extensao in EXTENSOES_VALIDAS:
-            novo_nome = f"nota_original_{contador_validos:03d}{extensao}"
-            novo_caminho_completo = os.path.join(caminho_lote, novo_nome)
-            
-            os.rename(caminho_original_completo, novo_caminho_completo)
-            
-            arquivos_validados.append({
-                "nome_original": nome_arquivo,
-                "nome_padronizado": novo_nome,
-                "caminho": novo_caminho_completo
-            })
-            contador_validos += 1
+        if tipo in TIPOS_ACEITOS:
+            self._contador_temporario += 1
+            caminho_temporario = os.path.join(self.caminho_lote, f".entrada_{self._contador_temporario:05d}.parcial")
+            with open(caminho_temporario, 'wb') as destino:
+                resultado = self._copiar_com_hash(fluxo, destino, limite, nome_membro)
+            if resultado is None:
+                os.remove(caminho_temporario)
+                return
+            sha256, tamanho = resultado
+            self.bytes_aceitos += tamanho
+            self.bytes_gravados += tamanho
+            self._registrar_unidade(caminho_temporario, extensao, sha256, os.path.basename(info.filename), nome_membro, tamanho)
+
+        elif tipo in TIPOS_COMPACTADOS:
+            if profundidade >= self.profundidade_max:
+                self._violacao(f"'{nome_membro}' excede a profundidade máxima de {self.profundidade_max} níveis de compactação. Ignorado.")
+                return
+            # Compactados aninhados precisam de seek: ficam em memória (ou em disco, se forem grandes)
+            with tempfile.SpooledTemporaryFile(max_size=LIMITE_MEMORIA_ANINHADO) as aninhado:
+                if self._copiar_com_hash(fluxo, aninhado, limite, nome_membro) is None:
+                    return
+                aninhado.seek(0)
+                try:
+                    self._percorrer_compactado(aninhado, tipo, nome_membro, profundidade + 1)
+                except (zipfile.BadZipFile, rarfile.Error) as e:
+                    self._violacao(f"'{nome_membro}' não é um arquivo compactado válido ou está corrompido: {e}")
         else:
-            shutil.move(caminho_original_completo, os.path.join(caminho_quarentena, nome_arquivo))
-            arquivos_em_quarentena.append(nome_arquivo)
+            # Membros não aceitos não são extraídos; ficam apenas listados como quarentena
+            self.quarentena.append(nome_membro)
+
+
+class _StreamComPrefixo(io.RawIOBase):
+    """Stream somente leitura que devolve 'prefixo' e depois o restante de 'stream'."""
+
+    def __init__(self, prefixo: bytes, stream):
+        self._prefixo = prefixo
+        self._stream = stream
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        if self._prefixo:
+            n = min(len(buffer), len(self._prefixo))
+            buffer[:n] = self._prefixo[:n]
+            self._prefixo = self._prefixo[n:]
+            return n
+        dados = self._stream.read(len(buffer))
+        buffer[:len(dados)] = dados
+        return len(dados)
+
+
+def agente_guardiao(caminho_lote: str, limites: dict = None) -> dict:
+    """
+    Processa todos os arquivos em um diretório de lote para validação, descompressão e padronização.
+    Arquivos compactados são lidos em streaming, o tipo é detectado pelo conteúdo e
+    duplicatas (mesmo SHA-256) são agrupadas em uma única unidade.
+    """
+    if limites is None:
+        limites = load_config().get("limites_entrada") or {}
+    entrada = _EntradaDoLote(caminho_lote, limites)
+    os.makedirs(entrada.caminho_quarentena, exist_ok=True)
+
+    for nome_arquivo in sorted(os.listdir(caminho_lote)):
+        caminho_completo = os.path.join(caminho_lote, nome_arquivo)
+        if not os.path.isfile(caminho_completo):
+            continue
+        entrada.processar_arquivo_enviado(caminho_completo, nome_arquivo)
+
+    registrar_io("guardiao", entrada.bytes_lidos, entrada.bytes_gravados)
+    print(f"Guardião: {len(entrada.validados)} nota(s) aceita(s), {entrada.duplicados} duplicata(s) agrupada(s), "
+          f"{len(entrada.quarentena)} arquivo(s) rejeitado(s), {len(entrada.violacoes)} violação(ões) de limite.")
 
     return {
-        "validados": arquivos_validados,
-        "quarentena": arquivos_em_quarentena
-    }
\ No newline at end of file
+        "validados": entrada.validados,
+        "quarentena": entrada.quarentena,
+        "duplicados": entrada.duplicados,
+        "violacoes": entrada.violacoes
+    }
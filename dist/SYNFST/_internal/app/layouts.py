@@ -0,0 +1,224 @@
+# app/layouts.py
+
+import re
+from typing import Dict, List, Optional, Tuple
+
+from .metrics import registrar_layout
+
+# ==============================================================================
+# CAMINHO RÁPIDO POR LAYOUT (SEM LLM)
+# ==============================================================================
+# Boa parte do volume vem de poucos layouts de prefeitura. Para eles, âncoras
+# identificam o layout e expressões regulares preenchem os campos diretamente.
+# Os valores passam por verificações (dígitos do CNPJ, base x alíquota = ISS) e
+# apenas os campos ausentes ou reprovados seguem para o LLM, com um prompt enxuto.
+#
+# Cada layout tem:
+#   - 'ancoras': regex que precisam TODAS aparecer no texto para reconhecer o layout;
+#   - 'secoes':  nome -> (regex de início, regex de fim) para limitar a busca
+#                (ex: o CNPJ do prestador e o do tomador usam o mesmo rótulo);
+#   - 'campos':  lista de (seção, regex). Cada grupo nomeado da regex preenche o
+#                campo de mesmo nome. A seção 'documento' é o texto inteiro.
+# Os valores são extraídos literalmente, como o LLM faria (ver prompt).
+# ==============================================================================
+
+# Incrementar ao alterar o registro: invalida resultados em cache gerados por layout.
+VERSAO_LAYOUTS = 1
+
+_VALOR = r"\d{1,3}(?:\.\d{3})*,\d{2}"
+_CNPJ = r"\d{2}\.?\d{3}\.?\d{3}/?\d{4}-?\d{1,2}"
+_DATA = r"\d{2}/\d{2}/\d{4}"
+
+LAYOUTS = {
+    "campinas": {
+        "ancoras": [r"PREFEITURA MUNICIPAL DE CAMPINAS", r"NFSe Campinas"],
+        "secoes": {
+            "prestador": (r"PRESTADOR DO SERVI[ÇC]O", r"TOMADOR DO SERVI[ÇC]O"),
+            "tomador": (r"TOMADOR DO SERVI[ÇC]O", r"DESCRI[ÇC][ÃA]O DO SERVI[ÇC]O"),
+        },
+        "campos": [
+            ("documento", r"N[úu]mero da NFS-?e\s+(?P<numero_nf>\d+)"),
+            ("documento", rf"Data e hora de emiss[ãa]o\s+(?P<data_emissao>{_DATA})"),
+            ("prestador", rf"CPF/CNPJ/NIF\s+(?P<prestador_cnpj>{_CNPJ})"),
+            ("prestador", r"Nome / Nome Empresarial\s+(?P<prestador_razao_social>[^\n]+)"),
+            ("prestador", r"Munic[ií]pio\s+(?P<prestador_municipio>[^\n/]+?)\s*/\s*(?P<prestador_uf>[A-Z]{2})\b"),
+            ("tomador", rf"CPF/CNPJ/NIF\s+(?P<tomador_cnpj>{_CNPJ})"),
+            ("tomador", r"Nome / Nome Empresarial\s+(?P<tomador_razao_social>[^\n]+)"),
+            ("tomador", r"Munic[ií]pio\s+(?P<tomador_municipio>[^\n/]+?)\s*/\s*(?P<tomador_uf>[A-Z]{2})\b"),
+            ("documento", r"DESCRI[ÇC][ÃA]O DO SERVI[ÇC]O PRESTADO\s*\n(?P<discriminacao_servicos>.+?)\n\s*Servi[çc]o\s"),
+            ("documento", r"Servi[çc]o\s+(?P<codigo_servico>\d{2}\.\d{2})\s*-"),
+            ("documento", rf"Valor total da NFSe Campinas \(R\$\)\s*(?P<valor_total>{_VALOR})"),
+            ("documento", rf"Base de c[áa]lculo do ISSQN \(R\$\)\s*(?P<base_calculo_iss>{_VALOR})"),
+            ("documento", r"Aliq\. \(%\)\s*(?P<aliquota_iss>\d+(?:,\d+)?)"),
+            ("documento", rf"Valor do ISSQN \(R\$\)\s*(?P<valor_iss>{_VALOR})"),
+        ],
+    },
+    "mogi_guacu": {
+        "ancoras": [r"PREFEITURA MUNICIPAL DE MOGI GUA[ÇC]U"],
+        "secoes": {
+            "prestador": (r"PRESTADOR DE SERVI[ÇC]OS", r"TOMADOR DE SERVI[ÇC]OS"),
+            "tomador": (r"TOMADOR DE SERVI[ÇC]OS", r"DISCRIMINA[ÇC][ÃA]O DOS SERVI[ÇC]OS"),
+        },
+        "campos": [
+            ("documento", r"N[úu]mero da Nota\s*-\s*S[ée]rie\s+(?P<numero_nf>\d+)"),
+            ("documento", rf"Data de Emiss[ãa]o\s+(?P<data_emissao>{_DATA})"),
+            ("prestador", r"Nome/Raz[ãa]o Social:\s*(?P<prestador_razao_social>[^\n]+)"),
+            ("prestador", rf"CPF/CNPJ:\s*(?P<prestador_cnpj>{_CNPJ})"),
+            ("prestador", r"Endere[çc]o:[^\n]*,\s*(?P<prestador_municipio>[^,\n]+?)\s*-\s*(?P<prestador_uf>[A-Z]{2})[ \t]*$"),
+            ("tomador", r"Nome/Raz[ãa]o Social:\s*(?P<tomador_razao_social>[^\n]+)"),
+            ("tomador", rf"CPF/CNPJ:\s*(?P<tomador_cnpj>{_CNPJ})"),
+            ("tomador", r"Endere[çc]o:[^\n]*,\s*(?P<tomador_municipio>[^,\n]+?)\s*-\s*(?P<tomador_uf>[A-Z]{2})[ \t]*$"),
+            ("documento", r"DISCRIMINA[ÇC][ÃA]O DOS SERVI[ÇC]OS\s*\n(?P<discriminacao_servicos>[^\n]+)"),
+            ("documento", r"(?P<observacoes_nf>Documento Emitido por Optante do Simples Nacional)"),
+            ("documento", r"C[óo]digo do Servi[çc]o\s+(?P<codigo_servico>\d{3,4})\s*-"),
+            ("documento", rf"Base de c[áa]lculo \(R\$\)\s*(?P<base_calculo_iss>{_VALOR})"),
+            ("documento", r"Al[ií]quota \(%\)\s*(?P<aliquota_iss>\d+(?:,\d+)?%?)"),
+            ("documento", rf"Vr do ISS \(R\$\)\s*(?P<valor_iss>{_VALOR})"),
+            ("documento", rf"VALOR TOTAL DA NOTA\s*=\s*R\$\s*(?P<valor_total>{_VALOR})"),
+        ],
+    },
+    "osasco": {
+        "ancoras": [r"Nota No\.:", r"Emitido em:", r"Munic[ií]pio:\s*Osasco"],
+        "secoes": {
+            "prestador": (r"PRESTADOR DE SERVI[ÇC]OS", r"TOMADOR DO SERVI[ÇC]O"),
+            "tomador": (r"TOMADOR DO SERVI[ÇC]O", r"C[óo]d\. Servi[çc]o"),
+        },
+        "campos": [
+            ("documento", r"Nota No\.:\s*(?P<numero_nf>\d+)"),
+            ("documento", rf"Emitido em:\s*(?P<data_emissao>{_DATA})"),
+            ("prestador", r"Raz[ãa]o Social/Nome:\s*(?P<prestador_razao_social>[^\n]+)"),
+            ("prestador", rf"CNPJ/CPF:\s*(?P<prestador_cnpj>{_CNPJ})"),
+            ("prestador", r"Munic[ií]pio:\s*(?P<prestador_municipio>[^\n]+?)\s+UF:\s*(?P<prestador_uf>[A-Z]{2})"),
+            ("tomador", r"Raz[ãa]o Social/Nome:\s*(?P<tomador_razao_social>[^\n]+)"),
+            ("tomador", rf"CNPJ/CPF:\s*(?P<tomador_cnpj>{_CNPJ})"),
+            ("tomador", r"Munic[ií]pio:\s*(?P<tomador_municipio>[^\n]+?)\s+UF:\s*(?P<tomador_uf>[A-Z]{2})"),
+            ("documento", r"C[óo]d\. Servi[çc]o\s+(?P<codigo_servico>\d{2}\.\d{2})"),
+            ("documento", r"DESCRI[ÇC][ÃA]O DOS SERVI[ÇC]OS E OUTRAS INFORMA[ÇC][ÕO]ES:\s*\n(?P<discriminacao_servicos>[^\n]+)"),
+            ("documento", rf"Valor ISS\s*\n\s*{_VALOR}\s+(?P<base_calculo_iss>{_VALOR})\s+(?P<aliquota_iss>\d+(?:,\d+)?)\s+(?P<valor_iss>{_VALOR})"),
+            ("documento", rf"Valor Total da Nota\s*\n[^\n]*?(?P<valor_total>{_VALOR})[ \t]*$"),
+        ],
+    },
+}
+
+# Campos que todo layout precisa entregar válidos para dispensar o LLM.
+CAMPOS_OBRIGATORIOS = [
+    "prestador_cnpj", "prestador_razao_social", "tomador_cnpj", "tomador_razao_social",
+    "numero_nf", "data_emissao", "codigo_servico",
+    "valor_total", "base_calculo_iss", "aliquota_iss", "valor_iss",
+]
+
+# Retenções federais com valor na mesma linha do rótulo. Se aparecerem e o layout
+# não as preencheu, o campo segue para o LLM em vez de ficar vazio.
+_RETENCOES = {
+    "valor_pis": r"\bPIS(?:/PASEP)?\b",
+    "valor_cofins": r"\bCOFINS\b",
+    "valor_csll": r"\bCSLL\b",
+    "valor_ir": r"\bIR(?:RF)?\b",
+    "valor_inss": r"\bINSS\b",
+}
+
+_FLAGS = re.IGNORECASE | re.MULTILINE | re.DOTALL
+
+# ==============================================================================
+# VERIFICAÇÕES
+# ==============================================================================
+
+def cnpj_valido(cnpj: Optional[str]) -> bool:
+    """Confere os dois dígitos verificadores do CNPJ."""
+    digitos = re.sub(r'\D', '', cnpj or "")
+    if len(digitos) != 14 or digitos == digitos[0] * 14:
+        return False
+    for tamanho in (12, 13):
+        pesos = list(range(tamanho - 7, 1, -1)) + list(range(9, 1, -1))
+        soma = sum(int(d) * p for d, p in zip(digitos[:tamanho], pesos))
+        dv = 11 - soma % 11
+        if (0 if dv >= 10 else dv) != int(digitos[tamanho]):
+            return False
+    return True
+
+def _para_float(valor: Optional[str]) -> Optional[float]:
+    if not valor:
+        return None
+    try:
+        return float(str(valor).replace('R$', '').replace('%', '').strip().replace('.', '').replace(',', '.'))
+    except ValueError:
+        return None
+
+def _aliquota_para_float(valor: Optional[str]) -> Optional[float]:
+    # A alíquota não tem separador de milhar: "4,8712%" -> 4.8712
+    try:
+        return float(str(valor).replace('%', '').strip().replace(',', '.'))
+    except (TypeError, ValueError):
+        return None
+
+def iss_consistente(base: Optional[str], aliquota: Optional[str], valor_iss: Optional[str]) -> bool:
+    """Confere se base x alíquota ≈ ISS (tolerância de arredondamento de 2 centavos)."""
+    base_f, aliq_f, iss_f = _para_float(base), _aliquota_para_float(aliquota), _para_float(valor_iss)
+    if base_f is None or aliq_f is None or iss_f is None:
+        return False
+    return abs(base_f * aliq_f / 100 - iss_f) <= 0.02
+
+def _verificar(dados: dict) -> List[str]:
+    """Retorna os campos reprovados nas verificações."""
+    reprovados = []
+    for campo in ("prestador_cnpj", "tomador_cnpj"):
+        if dados.get(campo) and not cnpj_valido(dados[campo]):
+            reprovados.append(campo)
+    if not iss_consistente(dados.get("base_calculo_iss"), dados.get("aliquota_iss"), dados.get("valor_iss")):
+        reprovados.extend(["base_calculo_iss", "aliquota_iss", "valor_iss"])
+    if _para_float(dados.get("valor_total")) is None:
+        reprovados.append("valor_total")
+    return reprovados
+
+# ==============================================================================
+# IDENTIFICAÇÃO E EXTRAÇÃO
+# ==============================================================================
+
+def identificar_layout(texto: str) -> Optional[str]:
+    for nome, layout in LAYOUTS.items():
+        if all(re.search(ancora, texto, _FLAGS) for ancora in layout["ancoras"]):
+            return nome
+    return None
+
+def _recortar_secao(texto: str, inicio: str, fim: str) -> str:
+    achou_inicio = re.search(inicio, texto, _FLAGS)
+    if not achou_inicio:
+        return ""
+    resto = texto[achou_inicio.end():]
+    achou_fim = re.search(fim, resto, _FLAGS)
+    return resto[:achou_fim.start()] if achou_fim else resto
+
+def extrair_por_layout(texto: str) -> Optional[Tuple[str, Dict[str, Optional[str]], List[str]]]:
+    """
+    Tenta extrair a nota por um layout conhecido. Retorna (nome do layout, campos
+    preenchidos, campos pendentes para o LLM) ou None se nenhum layout casar.
+    """
+    nome_layout = identificar_layout(texto)
+    if not nome_layout:
+        registrar_layout(None)
+        return None
+    layout = LAYOUTS[nome_layout]
+    secoes = {"documento": texto}
+    for nome_secao, (inicio, fim) in layout.get("secoes", {}).items():
+        secoes[nome_secao] = _recortar_secao(texto, inicio, fim)
+
+    dados = {}
+    for nome_secao, padrao in layout["campos"]:
+        achou = re.search(padrao, secoes.get(nome_secao, ""), _FLAGS)
+        if not achou:
+            continue
+        for campo, valor in achou.groupdict().items():
+            if valor and campo not in dados:
+                dados[campo] = " ".join(valor.split())
+
+    pendentes = [campo for campo in CAMPOS_OBRIGATORIOS if not dados.get(campo)]
+    pendentes += [campo for campo in _verificar(dados) if campo not in pendentes]
+    for campo, rotulo in _RETENCOES.items():
+        if not dados.get(campo) and re.search(rf"{rotulo}\s*(?:\(R\$\))?\s*:?\s*(?:R\$\s*)?{_VALOR}", texto, re.IGNORECASE):
+            pendentes.append(campo)
+    for campo in pendentes:
+        dados.pop(campo, None)
+
+    # Contagem por lote, no coletor de métricas ativo (ver app/metrics.py)
+    registrar_layout(nome_layout, llm_parcial=bool(pendentes))
+    return nome_layout, dados, pendentes
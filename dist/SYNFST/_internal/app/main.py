@@ -9,12 +9,17 @@ import fitz
 from PIL import Image
 import io
 import sys
+import multiprocessing
 import pytesseract
 
 # ==============================================================================
 # HOOK PARA PYINSTALLER - PONTO CRÍTICO PARA O EXECUTÁVEL FUNCIONAR
 # ==============================================================================
 if getattr(sys, 'frozen', False):
+    # O executável entra pelo run.py, que importa este módulo: o bloco '__main__'
+    # abaixo nunca roda ali. Os processos do pool de OCR reexecutam o .exe e
+    # precisam parar aqui, antes de montar a interface.
+    multiprocessing.freeze_support()
     application_path = os.path.dirname(sys.executable)
     bundle_dir = sys._MEIPASS
     tesseract_path_in_bundle = os.path.join(bundle_dir, 'tesseract-ocr', 'tesseract.exe')
@@ -35,11 +40,13 @@ from app.workflow import app_workflow
 from app.graph_state import LoteState
 
 # --- Módulos de Suporte ---
-from app.delivery import agente_entrega_final
+from app.delivery import agente_entrega_final, calcular_valor_crf
 from app.config_manager import (
     AVAILABLE_MODELS, load_config, save_config, 
     get_env_vars, save_env_vars, is_config_valid
 )
+from app.acum_index import carregar_indice_acum, remover_indice_acum
+from app.metrics import obter_coletor_do_lote
 
 # --- Criação de Diretórios ---
 os.makedirs(SAIDA_DIR, exist_ok=True)
@@ -92,6 +99,11 @@ def salvar_configuracoes(provider, model, custom_model, gcp_project, google_key,
         caminho_destino = os.path.join(CONFIG_DATA_DIR, os.path.basename(acum_map_file.name))
         shutil.copy(acum_map_file.name, caminho_destino)
         acum_map_path = caminho_destino
+        try:
+            # Compila o índice agora, para que o primeiro lote já o encontre pronto
+            carregar_indice_acum(acum_map_path)
+        except Exception as e:
+            print(f"AVISO: Não foi possível compilar a planilha de mapeamento 'Acum'. Erro: {e}")
     save_config(provider, model, custom_model, acum_mapping_file=acum_map_path)
     env_vars_to_save = {"GCP_PROJECT": gcp_project, "GOOGLE_API_KEY": google_key, "OPENAI_API_KEY": openai_key, "ANTHROPIC_API_KEY": anthropic_key, "MISTRAL_API_KEY": mistral_key, "GROQ_API_KEY": groq_key, "OLLAMA_BASE_URL": ollama_url}
     save_env_vars(env_vars_to_save)
@@ -106,6 +118,7 @@ def excluir_mapa_acum():
             os.remove(caminho_arquivo_map)
         except OSError as e:
             print(f"Erro ao excluir o arquivo: {e}")
+    remover_indice_acum(caminho_arquivo_map)
     save_config(provider=config.get("provider"), model=config.get("model"), custom_model=config.get("custom_model"), acum_mapping_file=None)
     return "Nenhum arquivo configurado.", "Arquivo de mapeamento removido."
 
@@ -147,17 +160,6 @@ def exibir_detalhes_nota(estado_do_lote: dict, df_visivel: pd.DataFrame, evt: gr
         print(f"Erro ao exibir detalhes: {e}")
         return [None] + [""] * len(FORM_FIELD_KEYS) + [gr.update(visible=False), None]
 
-def _limpar_e_converter_valor_para_calculo(valor) -> float:
-    if valor is None: return 0.0
-    if isinstance(valor, (int, float)): return float(valor)
-    valor_str = str(valor).strip()
-    if not valor_str: return 0.0
-    valor_limpo = re.sub(r'[^\d,.-]', '', valor_str).replace('.', '').replace(',', '.')
-    try:
-        return float(valor_limpo)
-    except (ValueError, TypeError):
-        return 0.0
-
 def atualizar_campos_dominio(codigo_servico: str):
     """
     Atualiza dinamicamente os campos 'Item' e 'Acum' com base no 'Código de Serviço'.
@@ -176,22 +178,9 @@ def atualizar_campos_dominio(codigo_servico: str):
 
     if caminho_map_acum and os.path.exists(caminho_map_acum) and codigo_servico:
         try:
-            df_map = pd.read_excel(caminho_map_acum, dtype=str)
-            df_map.columns = [str(c).strip() for c in df_map.columns]
-            
-            if 'Referência' in df_map.columns and 'ACUMULADOR TOMADOS' in df_map.columns:
-                codigo_servico_str = str(codigo_servico).strip()
-                
-                # Normaliza ambos os lados para comparação (apenas dígitos)
-                df_map['Referencia_Normalizada'] = df_map['Referência'].str.replace(r'\D', '', regex=True)
-                codigo_servico_normalizado = re.sub(r'\D', '', codigo_servico_str)
-
-                if codigo_servico_normalizado:
-                    resultado = df_map.loc[df_map['Referencia_Normalizada'] == codigo_servico_normalizado]
-                    if not resultado.empty:
-                        valor_acum = resultado['ACUMULADOR TOMADOS'].iloc[0]
-                        if valor_acum and not pd.isna(valor_acum):
-                            novo_acum = str(int(float(valor_acum)))
+            # Usa o índice compilado da planilha (sem reabrir o Excel a cada alteração)
+            indice = carregar_indice_acum(caminho_map_acum)
+            novo_acum = (indice.buscar(codigo_servico) if indice else None) or ""
         except Exception as e:
             print(f"AVISO: Falha ao buscar 'Acum' dinamicamente. Erro: {e}")
     return gr.update(value=novo_item), gr.update(value=novo_acum)
@@ -200,11 +189,7 @@ def salvar_e_aprovar(estado_do_lote, id_nota, *campos_formulario):
     if not id_nota or not estado_do_lote:
         return estado_do_lote, atualizar_dashboard(estado_do_lote), gr.update(interactive=False)
     dados_atualizados = dict(zip(FORM_FIELD_KEYS, campos_formulario))
-    valor_pis_num = _limpar_e_converter_valor_para_calculo(dados_atualizados.get("valor_pis"))
-    valor_cofins_num = _limpar_e_converter_valor_para_calculo(dados_atualizados.get("valor_cofins"))
-    valor_csll_num = _limpar_e_converter_valor_para_calculo(dados_atualizados.get("valor_csll"))
-    crf_calculado = valor_pis_num + valor_cofins_num + valor_csll_num
-    dados_atualizados["valor_crf"] = f"{crf_calculado:.2f}".replace('.', ',')
+    dados_atualizados["valor_crf"] = calcular_valor_crf(dados_atualizados)
     dados_originais = estado_do_lote[id_nota]["dados_extraidos"]
     dados_atualizados["todos_os_campos"] = dados_originais.get("todos_os_campos", [])
     estado_do_lote[id_nota]["dados_extraidos"] = dados_atualizados
@@ -214,19 +199,28 @@ def salvar_e_aprovar(estado_do_lote, id_nota, *campos_formulario):
     botao_finalizar_update = gr.update(interactive=todas_aprovadas)
     return estado_do_lote, df_atualizado, gr.update(visible=False), None, botao_finalizar_update
 
-def finalizar_processamento(estado_do_lote):
+def finalizar_processamento(estado_do_lote, id_lote):
     id_lote_folder_name = os.path.basename(os.path.dirname(next(iter(estado_do_lote.values()))["info_arquivo"]["caminho"]))
     caminho_saida_lote = os.path.join(SAIDA_DIR, id_lote_folder_name)
     os.makedirs(caminho_saida_lote, exist_ok=True)
-    caminhos_finais = agente_entrega_final(estado_do_lote, caminho_saida_lote)
-    return "Lote finalizado com sucesso! Faça o download abaixo.", gr.update(visible=True), gr.update(value=caminhos_finais.get("xlsx_importacao"), visible=True), gr.update(value=caminhos_finais.get("csv_importacao"), visible=True), gr.update(value=caminhos_finais.get("txt_importacao"), visible=True), gr.update(value=caminhos_finais.get("zip_notas"), visible=True)
+    # O coletor é o deste lote (pelo id guardado na sessão), não o último lote processado
+    coletor = obter_coletor_do_lote(id_lote)
+    caminhos_finais = agente_entrega_final(estado_do_lote, caminho_saida_lote, coletor)
+    # Regrava as métricas do lote, agora com a E/S da entrega
+    if coletor:
+        coletor.exportar(caminho_saida_lote)
+    return "Lote finalizado com sucesso! Faça o download abaixo.", gr.update(visible=True), gr.update(value=caminhos_finais.get("xlsx_importacao"), visible=True), gr.update(value=caminhos_finais.get("csv_importacao"), visible=True), gr.update(value=caminhos_finais.get("txt_importacao"), visible=True), gr.update(value=caminhos_finais.get("zip_notas"), visible=True), _tabela_metricas(coletor)
+
+def _tabela_metricas(coletor) -> pd.DataFrame:
+    """Resumo das métricas do lote para a tabela da interface."""
+    return pd.DataFrame(coletor.linhas_resumo() if coletor else [], columns=["Métrica", "Valor"])
 
 # ==============================================================================
 # FUNÇÃO 'processar_lote' CORRIGIDA E COMPLETA
 # ==============================================================================
 def processar_lote(arquivos, progress=gr.Progress(track_tqdm=True)):
     if not arquivos:
-        return "Erro: Nenhum arquivo foi selecionado.", {}, pd.DataFrame(), gr.update(visible=False), gr.update(visible=False), gr.update(interactive=False)
+        return "Erro: Nenhum arquivo foi selecionado.", {}, pd.DataFrame(), gr.update(visible=False), gr.update(visible=False), gr.update(interactive=False), _tabela_metricas(None), None
     try:
         progress(0, desc="Iniciando e criando lote...")
         
@@ -240,7 +234,7 @@ def processar_lote(arquivos, progress=gr.Progress(track_tqdm=True)):
             shutil.copy(arquivo_temp.name, os.path.join(caminho_lote, os.path.basename(arquivo_temp.name)))
         # --- FIM DO BLOCO RESTAURADO ---
 
-        initial_state = LoteState(id_lote=id_lote_uuid, caminho_lote=caminho_lote, unidades_de_processamento=[], resultados_extracao={}, status_geral="Iniciado", erros=[])
+        initial_state = LoteState(id_lote=id_lote_uuid, caminho_lote=caminho_lote, unidades_de_processamento=[], resultados_extracao={}, armazem_paginas=None, metricas=None, status_geral="Iniciado", erros=[])
         
         print(f"\n🚀 INVOCANDO WORKFLOW (STREAM) PARA O LOTE: {id_lote_uuid} 🚀\n")
         
@@ -273,6 +267,12 @@ def processar_lote(arquivos, progress=gr.Progress(track_tqdm=True)):
         
         dados_do_lote = final_state.get('resultados_extracao', {})
         erros_ocorridos = final_state.get('erros', [])
+
+        # Métricas do lote (metricas_lote.json/.csv) na mesma pasta da saída final
+        coletor = final_state.get('metricas')
+        if coletor:
+            caminhos_metricas = coletor.exportar(os.path.join(SAIDA_DIR, nome_pasta_lote))
+            print(f"Métricas do lote gravadas em: {caminhos_metricas['metricas_json']}")
         
         status_messages = [f"Processamento concluído! {len(dados_do_lote)} notas prontas para validação."]
         if erros_ocorridos:
@@ -282,16 +282,17 @@ def processar_lote(arquivos, progress=gr.Progress(track_tqdm=True)):
         mensagem_final = "\n".join(status_messages)
         df_para_exibir = atualizar_dashboard(dados_do_lote)
         
-        return mensagem_final, dados_do_lote, df_para_exibir, gr.update(visible=True), gr.update(visible=False), gr.update(interactive=False)
+        return mensagem_final, dados_do_lote, df_para_exibir, gr.update(visible=True), gr.update(visible=False), gr.update(interactive=False), _tabela_metricas(coletor), id_lote_uuid
     except Exception as e:
         import traceback
         traceback.print_exc()
-        return f"Erro crítico: {e}", {}, pd.DataFrame(), gr.update(visible=False), gr.update(visible=False), gr.update(interactive=False)
+        return f"Erro crítico: {e}", {}, pd.DataFrame(), gr.update(visible=False), gr.update(visible=False), gr.update(interactive=False), _tabela_metricas(None), None
 
 # --- Construção da Interface com Gradio ---
 with gr.Blocks(title="SYNFST - Automação Fiscal", theme=gr.themes.Soft()) as demo:
     estado_do_lote = gr.State({})
     id_nota_selecionada_state = gr.State(None)
+    id_lote_state = gr.State(None)
 
     gr.Markdown("# SYNFST - Sistema de Automação de Escrituração Fiscal")
     
@@ -339,6 +340,8 @@ with gr.Blocks(title="SYNFST - Automação Fiscal", theme=gr.themes.Soft()) as d
                     arquivos_input = gr.File(label="Selecione as Notas Fiscais", file_count="multiple")
                     btn_processar = gr.Button("Iniciar Processamento", variant="primary")
                     output_status = gr.Textbox(label="Status do Processamento", interactive=False, lines=8)
+                    with gr.Accordion("Métricas do Lote", open=False):
+                        df_metricas = gr.DataFrame(headers=["Métrica", "Valor"], interactive=False)
                 
                 with gr.Column(scale=3, visible=False) as dashboard_col:
                     gr.Markdown("### 2. Validar Dados")
@@ -441,12 +444,14 @@ with gr.Blocks(title="SYNFST - Automação Fiscal", theme=gr.themes.Soft()) as d
     btn_excluir_mapa.click(fn=excluir_mapa_acum, inputs=None, outputs=[cfg_acum_map_display, cfg_status])
 
     # Eventos da Aba de Processamento
-    btn_processar.click(fn=processar_lote, inputs=[arquivos_input], outputs=[output_status, estado_do_lote, df_display, dashboard_col, details_accordion, btn_finalizar])
+    btn_processar.click(fn=processar_lote, inputs=[arquivos_input], outputs=[output_status, estado_do_lote, df_display, dashboard_col, details_accordion, btn_finalizar, df_metricas, id_lote_state])
     df_display.select(fn=exibir_detalhes_nota, inputs=[estado_do_lote, df_display], outputs=[image_display, *form_components, details_accordion, id_nota_selecionada_state])
     form_codigo_servico.change(fn=atualizar_campos_dominio, inputs=[form_codigo_servico], outputs=[form_item, form_acum])
     btn_aprovar.click(fn=salvar_e_aprovar, inputs=[estado_do_lote, id_nota_selecionada_state, *form_components], outputs=[estado_do_lote, df_display, details_accordion, id_nota_selecionada_state, btn_finalizar])
-    btn_finalizar.click(fn=finalizar_processamento, inputs=[estado_do_lote], outputs=[output_status, download_col, file_xlsx_imp, file_csv_imp, file_txt_imp, file_zip_notas])
+    btn_finalizar.click(fn=finalizar_processamento, inputs=[estado_do_lote, id_lote_state], outputs=[output_status, download_col, file_xlsx_imp, file_csv_imp, file_txt_imp, file_zip_notas, df_metricas])
 
 
 if __name__ == "__main__":
+    # Execução direta (python -m app.main); no executável, ver o hook do PyInstaller no topo
+    multiprocessing.freeze_support()
     demo.launch()
\ No newline at end of file
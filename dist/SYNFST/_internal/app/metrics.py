@@ -0,0 +1,263 @@
+# app/metrics.py
+
+import contextvars
+import csv
+import functools
+import json
+import os
+import threading
+import time
+from typing import Optional
+
+# ==============================================================================
+# MÉTRICAS DO LOTE
+# ==============================================================================
+# Coleta estruturada do tempo gasto em cada etapa do lote:
+#   - tempo de parede e de CPU de cada nó do grafo;
+#   - decisão por página (texto direto x OCR) e duração do OCR;
+#   - latência, tokens e retentativas das chamadas ao LLM, por provedor;
+#   - notas lidas por layout conhecido (com ou sem LLM parcial) e não reconhecidas;
+#   - bytes lidos e gravados pelo guardião e pela entrega.
+# O coletor do lote fica no LoteState ('metricas') e também como coletor ativo
+# do contexto (ContextVar), para que extrator e OCR registrem eventos sem receber
+# o estado. Cada lote ativa o seu coletor no próprio contexto, então lotes
+# simultâneos no mesmo processo não se misturam; as threads do pool de LLM
+# recebem uma cópia do contexto de quem as submeteu.
+# Depois do grafo, o coletor é recuperado pelo 'id_lote' (obter_coletor_do_lote)
+# e passado explicitamente à entrega, que pode rodar bem depois e em outra sessão.
+# Nos processos do pool de OCR um coletor local é criado por tarefa e os
+# eventos voltam ao processo principal junto com o texto.
+# Os arquivos 'metricas_lote.json' e 'metricas_lote.csv' são gravados por lote.
+# ==============================================================================
+
+NOME_ARQUIVO_METRICAS = "metricas_lote"
+
+class ColetorMetricas:
+    """Acumula os eventos de métricas de um lote. Seguro para uso entre threads."""
+
+    def __init__(self, id_lote: Optional[str] = None):
+        self.id_lote = id_lote
+        self.inicio = time.time()
+        self._lock = threading.Lock()
+        self.nos = []
+        self.paginas = []
+        self.llm = []
+        self.io = {}
+        self.layouts = {}
+        self.layouts_nao_reconhecidos = 0
+
+    # --- Registro de eventos ---
+
+    def registrar_no(self, nome: str, wall_s: float, cpu_s: float):
+        with self._lock:
+            self.nos.append({"no": nome, "wall_s": round(wall_s, 4), "cpu_s": round(cpu_s, 4)})
+
+    def registrar_pagina(self, etapa: str, arquivo: str, pagina: int, decisao: str, duracao_s: float = 0.0, dpi: Optional[int] = None, caracteres: int = 0):
+        """'decisao': texto_direto, ocr, ocr_reaproveitado ou ocr_imagem."""
+        with self._lock:
+            self.paginas.append({
+                "etapa": etapa, "arquivo": os.path.basename(arquivo or ""), "pagina": pagina,
+                "decisao": decisao, "dpi": dpi, "duracao_s": round(duracao_s, 4), "caracteres": caracteres,
+            })
+
+    def registrar_llm(self, provider: str, modelo: str, latencia_s: float, tentativas: int, sucesso: bool, tokens_entrada: int = 0, tokens_saida: int = 0, prompt: str = "completo"):
+        with self._lock:
+            self.llm.append({
+                "provider": provider, "modelo": modelo, "prompt": prompt, "latencia_s": round(latencia_s, 4),
+                "tentativas": tentativas, "sucesso": sucesso,
+                "tokens_entrada": tokens_entrada or 0, "tokens_saida": tokens_saida or 0,
+            })
+
+    def registrar_io(self, etapa: str, bytes_lidos: int = 0, bytes_gravados: int = 0):
+        with self._lock:
+            totais = self.io.setdefault(etapa, {"bytes_lidos": 0, "bytes_gravados": 0})
+            totais["bytes_lidos"] += bytes_lidos
+            totais["bytes_gravados"] += bytes_gravados
+
+    def registrar_layout(self, nome_layout: Optional[str], llm_parcial: bool = False):
+        """'nome_layout' None indica texto que não casou com nenhum layout conhecido."""
+        with self._lock:
+            if nome_layout is None:
+                self.layouts_nao_reconhecidos += 1
+                return
+            contadores = self.layouts.setdefault(nome_layout, {"reconhecidas": 0, "sem_llm": 0, "llm_parcial": 0})
+            contadores["reconhecidas"] += 1
+            contadores["llm_parcial" if llm_parcial else "sem_llm"] += 1
+
+    def mesclar_paginas(self, eventos: list):
+        """Incorpora os eventos de página devolvidos por um processo do pool de OCR."""
+        with self._lock:
+            self.paginas.extend(eventos or [])
+
+    # --- Consolidação e exportação ---
+
+    def resumo(self) -> dict:
+        with self._lock:
+            nos, paginas, llm, io = list(self.nos), list(self.paginas), list(self.llm), dict(self.io)
+            layouts = {nome: dict(contadores) for nome, contadores in self.layouts.items()}
+            nao_reconhecidos = self.layouts_nao_reconhecidos
+
+        resumo_nos = {}
+        for evento in nos:
+            totais = resumo_nos.setdefault(evento["no"], {"wall_s": 0.0, "cpu_s": 0.0})
+            totais["wall_s"] = round(totais["wall_s"] + evento["wall_s"], 4)
+            totais["cpu_s"] = round(totais["cpu_s"] + evento["cpu_s"], 4)
+
+        por_decisao = {}
+        for evento in paginas:
+            por_decisao[evento["decisao"]] = por_decisao.get(evento["decisao"], 0) + 1
+        duracoes_ocr = [e["duracao_s"] for e in paginas if e["decisao"] in ("ocr", "ocr_imagem")]
+
+        resumo_llm = {}
+        for evento in llm:
+            totais = resumo_llm.setdefault(evento["provider"], {
+                "chamadas": 0, "falhas": 0, "retentativas": 0, "latencia_s_total": 0.0,
+                "tokens_entrada": 0, "tokens_saida": 0,
+            })
+            totais["chamadas"] += 1
+            totais["falhas"] += 0 if evento["sucesso"] else 1
+            totais["retentativas"] += max(0, evento["tentativas"] - 1)
+            totais["latencia_s_total"] = round(totais["latencia_s_total"] + evento["latencia_s"], 4)
+            totais["tokens_entrada"] += evento["tokens_entrada"]
+            totais["tokens_saida"] += evento["tokens_saida"]
+        for totais in resumo_llm.values():
+            totais["latencia_s_media"] = round(totais["latencia_s_total"] / totais["chamadas"], 4)
+
+        return {
+            "id_lote": self.id_lote,
+            "duracao_total_s": round(time.time() - self.inicio, 4),
+            "nos": resumo_nos,
+            "paginas": {
+                "total": len(paginas),
+                "por_decisao": por_decisao,
+                "ocr_s_total": round(sum(duracoes_ocr), 4),
+                "ocr_s_medio": round(sum(duracoes_ocr) / len(duracoes_ocr), 4) if duracoes_ocr else 0.0,
+            },
+            "llm": resumo_llm,
+            "layouts": {"por_layout": layouts, "nao_reconhecidas": nao_reconhecidos},
+            "io": io,
+        }
+
+    def linhas_resumo(self) -> list:
+        """Resumo em pares [métrica, valor], para exibição em tabela na interface."""
+        resumo = self.resumo()
+        linhas = [["Duração total (s)", resumo["duracao_total_s"]]]
+        for nome, totais in resumo["nos"].items():
+            linhas.append([f"Nó {nome} - parede / CPU (s)", f"{totais['wall_s']:.2f} / {totais['cpu_s']:.2f}"])
+        for decisao, quantidade in resumo["paginas"]["por_decisao"].items():
+            linhas.append([f"Páginas - {decisao}", quantidade])
+        if resumo["paginas"]["ocr_s_total"]:
+            linhas.append(["OCR - total / média por página (s)", f"{resumo['paginas']['ocr_s_total']:.2f} / {resumo['paginas']['ocr_s_medio']:.2f}"])
+        for provider, totais in resumo["llm"].items():
+            linhas.append([f"LLM {provider} - chamadas / falhas / retentativas", f"{totais['chamadas']} / {totais['falhas']} / {totais['retentativas']}"])
+            linhas.append([f"LLM {provider} - latência média (s)", totais["latencia_s_media"]])
+            linhas.append([f"LLM {provider} - tokens entrada / saída", f"{totais['tokens_entrada']} / {totais['tokens_saida']}"])
+        for nome, contadores in resumo["layouts"]["por_layout"].items():
+            linhas.append([f"Layout {nome} - reconhecidas / sem LLM / LLM parcial", f"{contadores['reconhecidas']} / {contadores['sem_llm']} / {contadores['llm_parcial']}"])
+        if resumo["layouts"]["nao_reconhecidas"]:
+            linhas.append(["Layout não reconhecido - notas", resumo["layouts"]["nao_reconhecidas"]])
+        for etapa, totais in resumo["io"].items():
+            linhas.append([f"E/S {etapa} - lidos / gravados (bytes)", f"{totais['bytes_lidos']} / {totais['bytes_gravados']}"])
+        return linhas
+
+    def exportar(self, pasta: str) -> dict:
+        """Grava 'metricas_lote.json' (resumo + eventos) e 'metricas_lote.csv' (um evento por linha)."""
+        os.makedirs(pasta, exist_ok=True)
+        with self._lock:
+            eventos = (
+                [{"tipo": "no", **e} for e in self.nos]
+                + [{"tipo": "pagina", **e} for e in self.paginas]
+                + [{"tipo": "llm", **e} for e in self.llm]
+                + [{"tipo": "layout", "layout": nome, **contadores} for nome, contadores in self.layouts.items()]
+                + ([{"tipo": "layout", "layout": None, "nao_reconhecidas": self.layouts_nao_reconhecidos}] if self.layouts_nao_reconhecidos else [])
+                + [{"tipo": "io", "etapa": etapa, **totais} for etapa, totais in self.io.items()]
+            )
+        caminho_json = os.path.join(pasta, f"{NOME_ARQUIVO_METRICAS}.json")
+        with open(caminho_json, 'w', encoding='utf-8') as f:
+            json.dump({"resumo": self.resumo(), "eventos": eventos}, f, indent=2, ensure_ascii=False)
+
+        colunas = []
+        for evento in eventos:
+            colunas.extend(c for c in evento if c not in colunas)
+        caminho_csv = os.path.join(pasta, f"{NOME_ARQUIVO_METRICAS}.csv")
+        with open(caminho_csv, 'w', encoding='utf-8', newline='') as f:
+            escritor = csv.DictWriter(f, fieldnames=colunas or ["tipo"], delimiter=';')
+            escritor.writeheader()
+            escritor.writerows(eventos)
+        return {"metricas_json": caminho_json, "metricas_csv": caminho_csv}
+
+# ==============================================================================
+# COLETOR ATIVO DO CONTEXTO
+# ==============================================================================
+_coletor_ativo = contextvars.ContextVar("coletor_metricas_ativo", default=None)
+
+# Coletores dos lotes recentes, por 'id_lote'. Limitado para não reter lotes antigos.
+MAX_COLETORES_GUARDADOS = 20
+_coletores_por_lote = {}
+_lock_coletores = threading.Lock()
+
+def ativar_coletor(coletor: Optional[ColetorMetricas]) -> Optional[ColetorMetricas]:
+    _coletor_ativo.set(coletor)
+    return coletor
+
+def coletor_ativo() -> Optional[ColetorMetricas]:
+    return _coletor_ativo.get()
+
+def guardar_coletor_do_lote(coletor: ColetorMetricas):
+    if coletor.id_lote is None:
+        return
+    with _lock_coletores:
+        _coletores_por_lote[coletor.id_lote] = coletor
+        while len(_coletores_por_lote) > MAX_COLETORES_GUARDADOS:
+            _coletores_por_lote.pop(next(iter(_coletores_por_lote)))
+
+def obter_coletor_do_lote(id_lote: Optional[str]) -> Optional[ColetorMetricas]:
+    with _lock_coletores:
+        return _coletores_por_lote.get(id_lote)
+
+def registrar_pagina(*args, **kwargs):
+    coletor = _coletor_ativo.get()
+    if coletor is not None:
+        coletor.registrar_pagina(*args, **kwargs)
+
+def registrar_llm(*args, **kwargs):
+    coletor = _coletor_ativo.get()
+    if coletor is not None:
+        coletor.registrar_llm(*args, **kwargs)
+
+def registrar_layout(*args, **kwargs):
+    coletor = _coletor_ativo.get()
+    if coletor is not None:
+        coletor.registrar_layout(*args, **kwargs)
+
+def registrar_io(*args, **kwargs):
+    coletor = _coletor_ativo.get()
+    if coletor is not None:
+        coletor.registrar_io(*args, **kwargs)
+
+def tamanho_arquivos(caminhos) -> int:
+    """Soma o tamanho em bytes dos arquivos existentes da lista."""
+    return sum(os.path.getsize(c) for c in caminhos if c and os.path.isfile(c))
+
+def medir_no(nome: str):
+    """
+    Decorador dos nós do grafo: registra tempo de parede e de CPU do processo.
+    O coletor do lote é criado no primeiro nó e guardado em state['metricas'].
+    O CPU dos processos do pool de OCR aparece na duração do OCR por página.
+    """
+    def decorador(funcao_no):
+        @functools.wraps(funcao_no)
+        def no_medido(state):
+            coletor = state.get("metricas")
+            if coletor is None:
+                coletor = state["metricas"] = ColetorMetricas(state.get("id_lote"))
+                guardar_coletor_do_lote(coletor)
+            token = _coletor_ativo.set(coletor)
+            inicio_wall, inicio_cpu = time.perf_counter(), time.process_time()
+            try:
+                return funcao_no(state)
+            finally:
+                coletor.registrar_no(nome, time.perf_counter() - inicio_wall, time.process_time() - inicio_cpu)
+                _coletor_ativo.reset(token)
+        return no_medido
+    return decorador
@@ -0,0 +1,165 @@
+# app/ocr.py
+
+import os
+import threading
+from typing import Optional, Sequence, Tuple
+
+import cv2
+import fitz
+import numpy as np
+import pytesseract
+from PIL import Image
+
+from .page_store import texto_tem_qualidade
+from .path_utils import resource_path
+
+# ==============================================================================
+# MOTORES DE OCR
+# ==============================================================================
+# O caminho antigo renderizava a página em RGB, codificava em PNG, decodificava
+# de volta, convertia para NumPy e ainda passava por um arquivo temporário e um
+# novo processo 'tesseract' a cada página. Aqui:
+#   - a página é renderizada direto em tons de cinza e lida do buffer do pixmap;
+#   - com o 'tesserocr' instalado, uma instância do Tesseract é reaproveitada
+#     por thread (e, portanto, por processo do pool de OCR);
+#   - sem ele, o 'pytesseract' continua sendo usado como alternativa;
+#   - o DPI começa baixo e só sobe quando a confiança do OCR é ruim.
+# ==============================================================================
+
+class MotorPytesseract:
+    """Alternativa padrão: um processo 'tesseract' por imagem (via 'image_to_data', com confiança)."""
+    nome = "pytesseract"
+
+    def __init__(self, lang: str, psm: int):
+        self.lang = lang
+        self.config = f"--psm {psm}"
+
+    def reconhecer(self, img: np.ndarray) -> Tuple[str, Optional[float]]:
+        # Uma única chamada devolve as palavras e a confiança de cada uma;
+        # as quebras de linha são refeitas pelos números de bloco/parágrafo/linha.
+        dados = pytesseract.image_to_data(Image.fromarray(img), lang=self.lang, config=self.config, output_type=pytesseract.Output.DICT)
+        linhas, confiancas = {}, []
+        for i, palavra in enumerate(dados["text"]):
+            confianca = float(dados["conf"][i])
+            if confianca < 0 or not palavra.strip():
+                continue
+            chave = (dados["block_num"][i], dados["par_num"][i], dados["line_num"][i])
+            linhas.setdefault(chave, []).append(palavra)
+            confiancas.append(confianca)
+        texto = "\n".join(" ".join(palavras) for palavras in linhas.values())
+        return texto, (sum(confiancas) / len(confiancas) if confiancas else 0.0)
+
+
+class MotorTesserocr:
+    """Tesseract na memória do processo (via 'tesserocr'), reutilizado entre páginas."""
+    nome = "tesserocr"
+
+    def __init__(self, lang: str, psm: int):
+        from tesserocr import PyTessBaseAPI
+
+        caminho_tessdata = resource_path(os.path.join("tesseract-ocr", "tessdata"))
+        argumentos = {"lang": lang, "psm": psm}
+        if os.path.isdir(caminho_tessdata):
+            argumentos["path"] = caminho_tessdata
+        self._api = PyTessBaseAPI(**argumentos)
+
+    def reconhecer(self, img: np.ndarray) -> Tuple[str, Optional[float]]:
+        img = np.ascontiguousarray(img)
+        altura, largura = img.shape[:2]
+        self._api.SetImageBytes(img.tobytes(), largura, altura, 1, largura)
+        return self._api.GetUTF8Text(), float(self._api.MeanTextConf())
+
+
+_motores_por_thread = threading.local()
+_tesserocr_disponivel = None
+
+def _tesserocr_importavel() -> bool:
+    global _tesserocr_disponivel
+    if _tesserocr_disponivel is None:
+        try:
+            import tesserocr  # noqa: F401
+            _tesserocr_disponivel = True
+        except ImportError:
+            _tesserocr_disponivel = False
+    return _tesserocr_disponivel
+
+def nome_motor_disponivel(lang: str = "por", psm: int = 6) -> str:
+    """
+    Motor que de fato iniciou neste ambiente (faz parte da chave do cache de texto).
+    Um 'tesserocr' que importa mas falha ao iniciar conta como 'pytesseract'.
+    """
+    return obter_motor(lang, psm).nome
+
+def obter_motor(lang: str = "por", psm: int = 6):
+    """Retorna o motor desta thread para (idioma, modo de segmentação), criando-o uma única vez."""
+    global _tesserocr_disponivel
+    motores = getattr(_motores_por_thread, "motores", None)
+    if motores is None:
+        motores = _motores_por_thread.motores = {}
+    chave = (lang, psm)
+    if chave not in motores:
+        motor = None
+        if _tesserocr_importavel():
+            try:
+                motor = MotorTesserocr(lang, psm)
+            except Exception as e:
+                print(f"AVISO: Não foi possível iniciar o tesserocr ({e}). Usando pytesseract.")
+                _tesserocr_disponivel = False
+        motores[chave] = motor or MotorPytesseract(lang, psm)
+    return motores[chave]
+
+# ==============================================================================
+# RENDERIZAÇÃO E PRÉ-PROCESSAMENTO
+# ==============================================================================
+
+def pre_processar_para_ocr(cinza: np.ndarray) -> np.ndarray:
+    """
+    Binarização adaptativa + remoção de ruído, melhorando a precisão do
+    Tesseract em documentos digitalizados. Recebe e devolve tons de cinza.
+    """
+    #    O threshold adaptativo é excelente para documentos com iluminação irregular.
+    binary = cv2.adaptiveThreshold(cinza, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C,
+                                   cv2.THRESH_BINARY, 11, 2)
+    # Remoção de Ruído (opcional, mas bom para digitalizações de baixa qualidade)
+    return cv2.medianBlur(binary, 3)
+
+def _reconhecer_pixmap(pix: fitz.Pixmap, motor, pre_processar: bool) -> Tuple[str, Optional[float]]:
+    # Visão direta do buffer do pixmap (sem cópia, sem PNG). O pixmap precisa
+    # continuar vivo enquanto a visão for usada, por isso tudo acontece aqui.
+    buffer = getattr(pix, "samples_mv", None) or pix.samples
+    cinza = np.frombuffer(buffer, dtype=np.uint8).reshape(pix.height, pix.stride)[:, :pix.width]
+    if pre_processar:
+        cinza = pre_processar_para_ocr(cinza)
+    return motor.reconhecer(cinza)
+
+def reconhecer_pagina(pagina: fitz.Page, dpi: int, lang: str = "por", psm: int = 6, pre_processar: bool = True) -> Tuple[str, Optional[float]]:
+    """Renderiza a página em tons de cinza no DPI pedido e aplica o OCR. Retorna (texto, confiança)."""
+    pix = pagina.get_pixmap(dpi=dpi, colorspace=fitz.csGRAY, alpha=False)
+    return _reconhecer_pixmap(pix, obter_motor(lang, psm), pre_processar)
+
+def _confianca_aceitavel(texto: str, confianca: Optional[float], confianca_minima: float) -> bool:
+    # Sem confiança informada pelo motor, vale a heurística de qualidade do texto
+    if confianca is not None:
+        return confianca >= confianca_minima and bool(texto.strip())
+    return texto_tem_qualidade(texto)
+
+def ocr_adaptativo(pagina: fitz.Page, dpis: Sequence[int], confianca_minima: float = 70, lang: str = "por", psm: int = 6) -> Tuple[str, int]:
+    """
+    Faz o OCR começando pelo menor DPI e só sobe para o próximo quando a confiança
+    fica abaixo do mínimo. Retorna (texto, DPI usado).
+    """
+    texto, dpi_usado = "", dpis[-1]
+    for dpi_usado in dpis:
+        texto, confianca = reconhecer_pagina(pagina, dpi_usado, lang=lang, psm=psm)
+        if _confianca_aceitavel(texto, confianca, confianca_minima):
+            break
+        if dpi_usado != dpis[-1]:
+            print(f"  - Confiança baixa no OCR a {dpi_usado} DPI ({confianca if confianca is not None else 'texto insuficiente'}). Tentando com DPI maior...")
+    return texto, dpi_usado
+
+def ocr_imagem(caminho_imagem: str, lang: str = "por", psm: int = 6) -> str:
+    """OCR de um arquivo de imagem (primeiro quadro), convertido direto para tons de cinza."""
+    with Image.open(caminho_imagem) as img:
+        cinza = np.asarray(img.convert("L"))
+    texto, _ = obter_motor(lang, psm).reconhecer(pre_processar_para_ocr(cinza))
+    return texto
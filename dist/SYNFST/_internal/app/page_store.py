@@ -0,0 +1,107 @@
+# app/page_store.py
+
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional
+
+# ==============================================================================
+# ARMAZÉM DE TEXTO POR PÁGINA (COMPARTILHADO PELO LOTE)
+# ==============================================================================
+# O segmentador e o extrator leem as mesmas páginas. Este armazém guarda, por
+# (arquivo, página), o texto direto do PDF e o melhor OCR já feito, para que a
+# página não seja renderizada e reconhecida duas vezes. As entradas são criadas
+# sob demanda; quando a memória passa do limite, as mais antigas vão para disco.
+# ==============================================================================
+
+PALAVRAS_CHAVE_FISCAIS = ["cnpj", "valor", "nota", "r$"]
+
+def texto_tem_qualidade(texto: str) -> bool:
+    """Heurística usada para decidir se o texto de uma página é confiável ou se precisa de (mais) OCR."""
+    texto_lower = (texto or "").lower()
+    return len(texto_lower.strip()) >= 150 and any(kw in texto_lower for kw in PALAVRAS_CHAVE_FISCAIS)
+
+def _tamanho_entrada(entrada: dict) -> int:
+    return sum(len(v) for v in entrada.values() if isinstance(v, str))
+
+
+class ArmazemPaginas:
+    """
+    Cada entrada é um dicionário com as chaves opcionais:
+      - 'texto_direto': texto extraído do PDF sem OCR;
+      - 'texto_ocr':    melhor texto de OCR obtido até agora;
+      - 'dpi_ocr':      DPI usado nesse OCR (um OCR de DPI maior substitui o de menor).
+    """
+
+    def __init__(self, diretorio_disco: str, max_mb_memoria: float = 64):
+        self.diretorio_disco = diretorio_disco
+        self.max_bytes_memoria = int(max_mb_memoria * 1024 * 1024)
+        self._memoria = OrderedDict()
+        self._em_disco = set()
+        self._bytes_memoria = 0
+        self._lock = threading.Lock()
+
+    def _caminho_disco(self, chave) -> str:
+        nome = hashlib.sha1(f"{chave[0]}|{chave[1]}".encode('utf-8')).hexdigest()
+        return os.path.join(self.diretorio_disco, f"{nome}.json")
+
+    def _carregar(self, chave) -> Optional[dict]:
+        if chave in self._memoria:
+            return self._memoria[chave]
+        if chave in self._em_disco:
+            with open(self._caminho_disco(chave), 'r', encoding='utf-8') as f:
+                return json.load(f)
+        return None
+
+    def _descarregar_excesso(self):
+        """Move as entradas mais antigas para disco até respeitar o limite de memória."""
+        while self._bytes_memoria > self.max_bytes_memoria and len(self._memoria) > 1:
+            chave, entrada = self._memoria.popitem(last=False)
+            os.makedirs(self.diretorio_disco, exist_ok=True)
+            with open(self._caminho_disco(chave), 'w', encoding='utf-8') as f:
+                json.dump(entrada, f, ensure_ascii=False)
+            self._em_disco.add(chave)
+            self._bytes_memoria -= _tamanho_entrada(entrada)
+
+    def obter(self, caminho_arquivo: str, num_pagina: int) -> Optional[dict]:
+        with self._lock:
+            entrada = self._carregar((os.path.abspath(caminho_arquivo), num_pagina))
+            return dict(entrada) if entrada else None
+
+    def atualizar(self, caminho_arquivo: str, num_pagina: int, **campos):
+        """Mescla os campos na entrada da página, mantendo sempre o OCR de maior DPI."""
+        chave = (os.path.abspath(caminho_arquivo), num_pagina)
+        with self._lock:
+            entrada = dict(self._carregar(chave) or {})
+            if "texto_ocr" in campos and (entrada.get("dpi_ocr") or 0) > (campos.get("dpi_ocr") or 0):
+                campos = {k: v for k, v in campos.items() if k not in ("texto_ocr", "dpi_ocr")}
+            entrada.update(campos)
+
+            if chave in self._memoria:
+                self._bytes_memoria -= _tamanho_entrada(self._memoria.pop(chave))
+            self._em_disco.discard(chave)
+            self._memoria[chave] = entrada
+            self._bytes_memoria += _tamanho_entrada(entrada)
+            self._descarregar_excesso()
+
+    def paginas_do_arquivo(self, caminho_arquivo: str, paginas: Optional[List[int]] = None) -> Dict[int, dict]:
+        """Retorna as entradas já conhecidas do arquivo (todas, ou apenas das páginas pedidas)."""
+        caminho_abs = os.path.abspath(caminho_arquivo)
+        with self._lock:
+            if paginas is None:
+                chaves = [c for c in list(self._memoria) + list(self._em_disco) if c[0] == caminho_abs]
+            else:
+                chaves = [(caminho_abs, p) for p in paginas]
+            encontradas = {}
+            for chave in chaves:
+                entrada = self._carregar(chave)
+                if entrada:
+                    encontradas[chave[1]] = dict(entrada)
+            return encontradas
+
+    def mesclar(self, caminho_arquivo: str, entradas: Dict[int, dict]):
+        """Incorpora entradas produzidas fora do processo (ex: pelo pool de OCR)."""
+        for num_pagina, campos in entradas.items():
+            self.atualizar(caminho_arquivo, num_pagina, **campos)
@@ -11,4 +11,13 @@ def resource_path(relative_path):
         # Se não estiver rodando como um bundle, o base_path é o diretório do nosso script principal
         base_path = os.path.abspath(".")
 
-    return os.path.join(base_path, relative_path)
\ No newline at end of file
+    return os.path.join(base_path, relative_path)
+
+def data_path(*partes):
+    """ Retorna o caminho absoluto dentro da pasta 'dados' da aplicação (ao lado do executável ou no diretório atual). """
+    if getattr(sys, 'frozen', False):
+        base_path = os.path.dirname(sys.executable)
+    else:
+        base_path = os.getcwd()
+
+    return os.path.join(base_path, "dados", *partes)
\ No newline at end of file
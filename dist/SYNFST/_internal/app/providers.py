@@ -0,0 +1,86 @@
+# app/providers.py
+
+import importlib
+import os
+import threading
+
+from .config_manager import AVAILABLE_MODELS
+
+# ==============================================================================
+# FÁBRICA E POOL DE MODELOS DE CHAT
+# ==============================================================================
+# Os pacotes LangChain de cada provedor são pesados; importar os seis no início
+# deixa a aplicação lenta para abrir. Aqui cada provedor é importado apenas
+# quando for usado, e um único cliente por provedor/modelo/credencial é criado e
+# reaproveitado por todas as notas (e threads) do processo.
+# ==============================================================================
+
+def _exigir_env(nome_variavel: str, mensagem: str) -> str:
+    valor = os.getenv(nome_variavel)
+    if not valor:
+        raise ValueError(mensagem)
+    return valor
+
+# provedor -> (módulo, classe, função que monta os argumentos do construtor)
+PROVEDORES_CHAT = {
+    "google": ("langchain_google_genai", "ChatGoogleGenerativeAI", lambda modelo: {
+        "model": modelo, "temperature": 0.0,
+        "google_api_key": _exigir_env("GOOGLE_API_KEY", "A chave de API do Google (GOOGLE_API_KEY) não foi encontrada."),
+    }),
+    "openai": ("langchain_openai", "ChatOpenAI", lambda modelo: {
+        "model_name": modelo, "temperature": 0.0, "api_key": os.getenv("OPENAI_API_KEY"),
+    }),
+    "anthropic": ("langchain_anthropic", "ChatAnthropic", lambda modelo: {
+        "model_name": modelo, "temperature": 0.0, "api_key": os.getenv("ANTHROPIC_API_KEY"),
+    }),
+    "mistral": ("langchain_mistralai", "ChatMistralAI", lambda modelo: {
+        "model_name": modelo, "temperature": 0.0, "api_key": os.getenv("MISTRAL_API_KEY"),
+    }),
+    "groq": ("langchain_groq", "ChatGroq", lambda modelo: {
+        "model_name": modelo, "temperature": 0.0, "api_key": os.getenv("GROQ_API_KEY"),
+    }),
+    "ollama": ("langchain_community.chat_models", "ChatOllama", lambda modelo: {
+        "model": modelo, "temperature": 0.0,
+        "base_url": _exigir_env("OLLAMA_BASE_URL", "A variável OLLAMA_BASE_URL não está definida."),
+    }),
+}
+
+# Provedores registrados em tempo de execução (ex: o LLM simulado do benchmark)
+_fabricas_extras = {}
+_pool = {}
+_pool_lock = threading.Lock()
+
+def registrar_provedor(provider: str, fabrica):
+    """Registra uma fábrica 'fabrica(nome_modelo) -> modelo de chat' para um provedor extra."""
+    with _pool_lock:
+        _fabricas_extras[provider] = fabrica
+        for chave in [c for c in _pool if c[0] == provider]:
+            del _pool[chave]
+
+def _assinatura_credenciais(provider: str) -> tuple:
+    # Se o usuário trocar a chave de API na interface, um novo cliente é criado
+    info = AVAILABLE_MODELS.get(provider, {})
+    nomes = ([info["api_key_name"]] if info.get("api_key_name") else []) + list(info.get("extra_vars", []))
+    return tuple(os.getenv(nome) for nome in nomes)
+
+def obter_modelo_chat(provider: str, model_name: str):
+    """Retorna o cliente de chat do provedor/modelo, importando o pacote e criando-o só na primeira vez."""
+    chave = (provider, model_name, _assinatura_credenciais(provider))
+    with _pool_lock:
+        if chave in _pool:
+            return _pool[chave]
+        if provider in _fabricas_extras:
+            modelo = _fabricas_extras[provider](model_name)
+        elif provider in PROVEDORES_CHAT:
+            nome_modulo, nome_classe, montar_argumentos = PROVEDORES_CHAT[provider]
+            argumentos = montar_argumentos(model_name)
+            try:
+                classe = getattr(importlib.import_module(nome_modulo), nome_classe)
+            except ImportError as e:
+                raise ValueError(f"O pacote '{nome_modulo}' do provedor '{provider}' não está instalado: {e}")
+            modelo = classe(**argumentos)
+        else:
+            raise ValueError(f"Provedor '{provider}' não suportado.")
+        print(f"Cliente de IA criado para {provider}/{model_name} (reaproveitado pelo restante do processo).")
+        _pool[chave] = modelo
+        return modelo
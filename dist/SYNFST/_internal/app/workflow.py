@@ -1,54 +1,88 @@
 # app/workflow.py
 
+import contextvars
 import fitz
+import os
 import re
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
 from typing import List
+from dotenv import load_dotenv
 from langgraph.graph import StateGraph, END
 
 # --- NOVOS IMPORTS para o OCR dentro do Segmentador ---
-import pytesseract
-from PIL import Image
-import io
+from .ocr import reconhecer_pagina
 
 from .graph_state import LoteState
 from .guardian import agente_guardiao
-from .extractor import agente_extrator, enriquecer_dados_acum
-from .config_manager import load_config
+from .extractor import _extrair_texto_com_metricas, obter_texto_bruto, chave_cache_texto, estruturar_texto_extraido, enriquecer_dados_acum
+from .cache import obter_cache
+from .page_store import ArmazemPaginas, texto_tem_qualidade
+from .config_manager import load_config, get_provider_limits
+from .metrics import medir_no, registrar_pagina
 
 # ==============================================================================
 # NOVA FUNÇÃO AUXILIAR: Extração de texto confiável por página
 # ==============================================================================
-def _get_texto_confiavel_da_pagina(pagina: fitz.Page) -> str:
+def _get_texto_confiavel_da_pagina(pagina: fitz.Page, armazem: ArmazemPaginas = None, caminho_arquivo: str = None) -> str:
     """
     Extrai o texto de uma única página. Se o texto direto for insuficiente,
-    aciona o OCR para garantir uma leitura de alta qualidade.
+    aciona o OCR para garantir uma leitura de alta qualidade. Com um 'armazem',
+    o texto direto e o OCR ficam guardados para o extrator reaproveitar.
     """
-    texto_direto = pagina.get_text("text", sort=True)
-    texto_lower = texto_direto.lower()
+    num_pagina = pagina.number + 1
+    inicio = time.perf_counter()
+    entrada = (armazem.obter(caminho_arquivo, num_pagina) if armazem else None) or {}
+    texto_direto = entrada.get("texto_direto")
+    if texto_direto is None:
+        texto_direto = pagina.get_text("text", sort=True)
+        if armazem:
+            armazem.atualizar(caminho_arquivo, num_pagina, texto_direto=texto_direto)
 
     # Se o texto for curto ou não contiver palavras fiscais, use OCR
-    if len(texto_lower.strip()) < 150 or not any(kw in texto_lower for kw in ["cnpj", "valor", "nota", "r$"]):
+    if not texto_tem_qualidade(texto_direto):
+        if entrada.get("texto_ocr") is not None:
+            registrar_pagina("segmentador", caminho_arquivo, num_pagina, "ocr_reaproveitado", dpi=entrada.get("dpi_ocr"), caracteres=len(entrada["texto_ocr"]))
+            return entrada["texto_ocr"]
         try:
-            pix = pagina.get_pixmap(dpi=200) # DPI otimizado para velocidade/precisão
-            img_pil = Image.frombytes("RGB", [pix.width, pix.height], pix.samples)
+            # 200 DPI em tons de cinza: otimizado para velocidade/precisão.
             # Não precisamos do pré-processamento pesado do OpenCV aqui, o Tesseract é suficiente para detecção
-            return pytesseract.image_to_string(img_pil, lang='por')
+            texto_ocr, _ = reconhecer_pagina(pagina, dpi=200, lang='por', psm=3, pre_processar=False)
+            if armazem:
+                armazem.atualizar(caminho_arquivo, num_pagina, texto_ocr=texto_ocr, dpi_ocr=200)
+            registrar_pagina("segmentador", caminho_arquivo, num_pagina, "ocr", time.perf_counter() - inicio, dpi=200, caracteres=len(texto_ocr))
+            return texto_ocr
         except Exception as e:
-            print(f"  - AVISO: Falha no OCR da página {pagina.number + 1}. Erro: {e}")
+            print(f"  - AVISO: Falha no OCR da página {num_pagina}. Erro: {e}")
             return "" # Retorna vazio em caso de erro no OCR
+    registrar_pagina("segmentador", caminho_arquivo, num_pagina, "texto_direto", time.perf_counter() - inicio, caracteres=len(texto_direto))
     return texto_direto
 
+def _obter_armazem(state: LoteState) -> ArmazemPaginas:
+    """Cria (na primeira chamada) o armazém de páginas do lote, com transbordo para disco."""
+    if state.get("armazem_paginas") is None:
+        config = load_config()
+        state["armazem_paginas"] = ArmazemPaginas(
+            os.path.join(state["caminho_lote"], ".paginas"),
+            max_mb_memoria=config.get("paginas_max_mb_memoria", 64)
+        )
+    return state["armazem_paginas"]
+
 # --- NÓS DO GRAFO ---
 
+@medir_no("guardiao")
 def no_guardiao(state: LoteState) -> LoteState:
     print("--- NÓ DO GRAFO: EXECUTANDO AGENTE GUARDIÃO ---")
     resultado_guardian = agente_guardiao(state['caminho_lote'])
     state['unidades_de_processamento'] = resultado_guardian["validados"]
+    # Violações de limite (tamanho, zip-bomb, quantidade de arquivos) aparecem nos avisos do lote
+    state['erros'] = state.get('erros', []) + resultado_guardian.get("violacoes", [])
     return state
 
 # ==============================================================================
 # NÓ SEGMENTADOR ATUALIZADO
 # ==============================================================================
+@medir_no("segmentador")
 def no_segmentador(state: LoteState) -> LoteState:
     """
     Nó determinístico APRIMORADO. Usa OCR por página se necessário para garantir a
@@ -57,6 +91,7 @@ def no_segmentador(state: LoteState) -> LoteState:
     print("--- NÓ DO GRAFO: EXECUTANDO AGENTE SEGMENTADOR (COM OCR) ---")
     tarefas_de_extracao = []
     arquivos_do_guardiao = state['unidades_de_processamento']
+    armazem = _obter_armazem(state)
 
     PALAVRAS_CHAVE_INICIO_NF = [
         "nota fiscal de serviços eletrônica", "nfs-e", "prefeitura municipal de",
@@ -81,7 +116,7 @@ def no_segmentador(state: LoteState) -> LoteState:
                 print(f"  - Analisando página {i + 1}...")
                 pagina = doc.load_page(i)
                 # Usa a nova função para garantir que temos um texto bom para análise
-                texto_pagina = _get_texto_confiavel_da_pagina(pagina).lower()
+                texto_pagina = _get_texto_confiavel_da_pagina(pagina, armazem, caminho_arquivo).lower()
                 
                 # Se a página tiver mais de 100 caracteres e uma palavra-chave, é uma nova nota
                 if len(texto_pagina.strip()) > 100 and any(keyword in texto_pagina for keyword in PALAVRAS_CHAVE_INICIO_NF):
@@ -108,17 +143,91 @@ def no_segmentador(state: LoteState) -> LoteState:
     state["unidades_de_processamento"] = tarefas_de_extracao
     return state
 
+# ==============================================================================
+# EXTRAÇÃO CONCORRENTE
+# ==============================================================================
+# O OCR é CPU-bound e roda em um pool de processos (um por núcleo). A chamada ao
+# LLM é I/O-bound e roda em um pool de threads, limitado pela concorrência e RPM
+# configurados para o provedor. Cada nota segue para o LLM assim que seu texto
+# fica pronto, então OCR e estruturação se sobrepõem.
+# ==============================================================================
+def _extrair_em_paralelo(tarefas: List[dict], config: dict, armazem: ArmazemPaginas, coletor) -> List[dict]:
+    provider = config.get("provider")
+    limites = get_provider_limits(provider, config)
+    num_processos = config.get("ocr_processos") or os.cpu_count() or 1
+    num_processos = max(1, min(int(num_processos), len(tarefas)))
+    print(f"Extração paralela: {num_processos} processo(s) de OCR, até {limites['concorrencia']} chamada(s) simultânea(s) ao provedor '{provider}' ({limites['rpm'] or 'sem limite de'} RPM).")
+
+    cache = obter_cache(config)
+    resultados = [None] * len(tarefas)
+    # As chamadas ao LLM rodam com uma cópia do contexto: o coletor de métricas ativo é o deste lote
+    with ProcessPoolExecutor(max_workers=num_processos) as pool_ocr, \
+         ThreadPoolExecutor(max_workers=limites["concorrencia"]) as pool_llm:
+        futuros_ocr = {}
+        futuros_llm = {}
+        for indice, tarefa in enumerate(tarefas):
+            caminho_arquivo = tarefa["info_arquivo_original"]["caminho"]
+            # O cache é consultado aqui, no processo principal: só os 'misses' vão para o pool de OCR
+            chave = chave_cache_texto(caminho_arquivo, tarefa.get("paginas")) if cache.habilitado else None
+            texto_em_cache = cache.obter_texto(chave) if chave else None
+            if texto_em_cache is not None:
+                futuros_llm[pool_llm.submit(contextvars.copy_context().run, estruturar_texto_extraido, caminho_arquivo, texto_em_cache, config)] = indice
+            else:
+                # Os processos do pool não enxergam o armazém: as páginas já conhecidas vão junto da tarefa
+                paginas_conhecidas = armazem.paginas_do_arquivo(caminho_arquivo, tarefa.get("paginas"))
+                futuros_ocr[pool_ocr.submit(_extrair_texto_com_metricas, caminho_arquivo, tarefa.get("paginas"), paginas_conhecidas)] = (indice, chave)
+
+        for futuro in as_completed(futuros_ocr):
+            indice, chave = futuros_ocr[futuro]
+            caminho_arquivo = tarefas[indice]["info_arquivo_original"]["caminho"]
+            try:
+                texto_bruto, paginas_novas, eventos_paginas = futuro.result()
+                armazem.mesclar(caminho_arquivo, paginas_novas)
+                coletor.mesclar_paginas(eventos_paginas)
+            except Exception as e:
+                print(f"Erro no processo de OCR para '{caminho_arquivo}': {e}")
+                texto_bruto = f"ERRO_NA_EXTRACAO_LOCAL: {e}"
+            if chave and texto_bruto and not texto_bruto.startswith("ERRO"):
+                cache.salvar_texto(chave, texto_bruto)
+            futuros_llm[pool_llm.submit(contextvars.copy_context().run, estruturar_texto_extraido, caminho_arquivo, texto_bruto, config)] = indice
+
+        for futuro in as_completed(futuros_llm):
+            indice = futuros_llm[futuro]
+            try:
+                resultados[indice] = futuro.result()
+            except Exception as e:
+                resultados[indice] = {"erro": f"Falha inesperada na estruturação: {e}"}
+    return resultados
+
+def _extrair_em_sequencia(tarefas: List[dict], config: dict, armazem: ArmazemPaginas) -> List[dict]:
+    resultados = []
+    for tarefa in tarefas:
+        caminho_arquivo = tarefa["info_arquivo_original"]["caminho"]
+        texto_bruto = obter_texto_bruto(caminho_arquivo, paginas=tarefa.get("paginas"), config=config, armazem=armazem)
+        resultados.append(estruturar_texto_extraido(caminho_arquivo, texto_bruto, config))
+    return resultados
+
+@medir_no("extrator")
 def no_extrator(state: LoteState) -> LoteState:
     print("--- NÓ DO GRAFO: EXECUTANDO AGENTE EXTRATOR ---")
+    load_dotenv(override=True)
+    config = load_config()
     resultados = {}
     tarefas = state.get('unidades_de_processamento', [])
+    armazem = _obter_armazem(state)
 
-    for i, tarefa in enumerate(tarefas):
+    if config.get("extracao_paralela", True) and len(tarefas) > 1:
+        dados_por_tarefa = _extrair_em_paralelo(tarefas, config, armazem, state["metricas"])
+    else:
+        dados_por_tarefa = _extrair_em_sequencia(tarefas, config, armazem)
+
+    estatisticas_cache = obter_cache(config).estatisticas()
+    print(f"Cache de extração - texto: {estatisticas_cache['texto']} | resultado: {estatisticas_cache['resultado']}")
+
+    # Os IDs seguem a ordem das tarefas, não a ordem em que terminaram
+    for i, (tarefa, dados_ia) in enumerate(zip(tarefas, dados_por_tarefa)):
         info_original = tarefa["info_arquivo_original"]
         paginas = tarefa.get("paginas")
-        caminho_arquivo = info_original["caminho"]
-        
-        dados_ia = agente_extrator(caminho_arquivo, paginas=paginas)
         
         id_nota = f"NF_{i+1:03d}"
         
@@ -142,6 +251,7 @@ def no_extrator(state: LoteState) -> LoteState:
     state['resultados_extracao'] = resultados
     return state
     
+@medir_no("enriquecimento")
 def no_enriquecimento(state: LoteState) -> LoteState:
     print("--- NÓ DO GRAFO: EXECUTANDO AGENTE DE ENRIQUECIMENTO ---")
     config = load_config()
@@ -0,0 +1,9 @@
+# tests/conftest.py
+
+import os
+import sys
+
+# Os testes importam o pacote 'app' a partir de dist/SYNFST/_internal. A pasta entra
+# no fim do sys.path para que as bibliotecas empacotadas (Windows) não substituam as
+# instaladas no ambiente de teste.
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,20 @@
+# tests/test_cli.py
+
+from app import cli
+
+
+def test_main_entrada_inexistente_termina_com_erro(tmp_path, capsys):
+    codigo = cli.main([str(tmp_path / "nao_existe")])
+
+    assert codigo == 1
+    assert "nenhuma das entradas foi encontrada" in capsys.readouterr().err
+
+
+def test_main_lote_sem_notas_termina_com_erro(tmp_path, monkeypatch, capsys):
+    relatorio_vazio = {"total_notas": 0, "aprovadas": 0, "arquivos_gerados": {"relatorio": str(tmp_path / "relatorio_lote.json")}}
+    monkeypatch.setattr(cli, "processar_em_lote", lambda entradas, saida: relatorio_vazio)
+
+    codigo = cli.main([str(tmp_path)])
+
+    assert codigo == 1
+    assert "nenhuma nota foi encontrada" in capsys.readouterr().err
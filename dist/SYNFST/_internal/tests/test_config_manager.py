@@ -0,0 +1,25 @@
+# tests/test_config_manager.py
+
+import json
+
+from app import config_manager
+
+
+def test_save_config_grava_apenas_as_chaves_da_interface(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    with open(config_manager.CONFIG_FILE, 'w', encoding='utf-8') as f:
+        json.dump({"provider": "openai", "cache_max_mb": 128}, f)
+
+    config_manager.save_config("google", "gemini-2.5-flash")
+
+    with open(config_manager.CONFIG_FILE, encoding='utf-8') as f:
+        gravado = json.load(f)
+    assert gravado == {"provider": "google", "model": "gemini-2.5-flash", "custom_model": "", "acum_mapping_file": None, "cache_max_mb": 128}
+
+
+def test_load_config_nao_compartilha_dicionarios_do_padrao(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+
+    config_manager.load_config()["limites_entrada"]["membros_max"] = 1
+
+    assert config_manager.DEFAULT_CONFIG["limites_entrada"]["membros_max"] == 5000
@@ -0,0 +1,26 @@
+# tests/test_delivery.py
+
+import zipfile
+
+from app.delivery import gerar_zip_das_notas
+
+
+def _nota(caminho, dados, **info):
+    return {"status": "Aprovado", "dados_extraidos": dados, "info_arquivo": {"caminho": str(caminho), **info}}
+
+
+def test_zip_segue_com_campos_nulos_e_nota_invalida(tmp_path):
+    origem_a, origem_b = tmp_path / "a.png", tmp_path / "b.png"
+    origem_a.write_bytes(b"a")
+    origem_b.write_bytes(b"b")
+    estado = {
+        # 'numero_nf' e 'data_emissao' presentes, mas nulos
+        "NF_001": _nota(origem_a, {"prestador_cnpj": "11.222.333/0001-81", "numero_nf": None, "data_emissao": None}, nome_original="a.png"),
+        # Sem nome de arquivo: falha ao montar o nome e fica fora do .zip
+        "NF_002": _nota(origem_b, {"numero_nf": "10"}),
+    }
+
+    caminho_zip, _ = gerar_zip_das_notas(estado, str(tmp_path), manter_arquivos_soltos=False)
+
+    with zipfile.ZipFile(caminho_zip) as zipf:
+        assert zipf.namelist() == ["11222333000181_SEM_NUM_SEM_DATA.png"]
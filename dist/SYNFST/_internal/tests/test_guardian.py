@@ -0,0 +1,29 @@
+# tests/test_guardian.py
+
+import struct
+
+from app.guardian import agente_guardiao, identificar_tipo
+
+
+def _pdf(texto: str) -> bytes:
+    return b"%PDF-1.4\n" + texto.encode() + b"\n%%EOF\n"
+
+
+def test_envio_com_nome_padronizado_nao_e_sobrescrito(tmp_path):
+    (tmp_path / "a.pdf").write_bytes(_pdf("a"))
+    (tmp_path / "nota_original_001.pdf").write_bytes(_pdf("b"))
+
+    resultado = agente_guardiao(str(tmp_path), limites={})
+
+    conteudos = sorted((tmp_path / unidade["nome_padronizado"]).read_bytes() for unidade in resultado["validados"])
+    assert conteudos == [_pdf("a"), _pdf("b")]
+
+
+def test_bmp_exige_cabecalho_coerente():
+    corpo = b"\x00" * 8
+    tamanho = 14 + 40 + len(corpo)
+    bmp = b"BM" + struct.pack("<IHHI", tamanho, 0, 0, 54) + struct.pack("<I", 40) + b"\x00" * 36 + corpo
+
+    assert identificar_tipo(bmp, len(bmp)) == ("imagem", ".bmp")
+    assert identificar_tipo(bmp, len(bmp) + 1) == (None, None)
+    assert identificar_tipo(b"BM qualquer texto que comece assim", 34) == (None, None)
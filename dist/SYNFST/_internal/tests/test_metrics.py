@@ -0,0 +1,32 @@
+# tests/test_metrics.py
+
+import threading
+
+from app import metrics
+
+
+def test_lotes_simultaneos_registram_no_proprio_coletor():
+    barreira = threading.Barrier(2)
+
+    @metrics.medir_no("extrator")
+    def no_extrator(state):
+        # Os dois lotes ficam ativos ao mesmo tempo antes de registrar os eventos
+        barreira.wait()
+        metrics.registrar_layout(state["layout"])
+        return state
+
+    estados = [
+        {"id_lote": "lote_a", "metricas": None, "layout": "campinas"},
+        {"id_lote": "lote_b", "metricas": None, "layout": None},
+    ]
+    threads = [threading.Thread(target=no_extrator, args=(estado,)) for estado in estados]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    resumo_a = estados[0]["metricas"].resumo()["layouts"]
+    resumo_b = estados[1]["metricas"].resumo()["layouts"]
+    assert resumo_a == {"por_layout": {"campinas": {"reconhecidas": 1, "sem_llm": 1, "llm_parcial": 0}}, "nao_reconhecidas": 0}
+    assert resumo_b == {"por_layout": {}, "nao_reconhecidas": 1}
+    assert metrics.obter_coletor_do_lote("lote_a") is estados[0]["metricas"]